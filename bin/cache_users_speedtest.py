@@ -0,0 +1,93 @@
+""" Measures how fast fetched profiles are set on cached users.
+
+Usage: python bin/cache_users_speedtest.py [n ...]
+
+Profiles for 50, 500 and 5000 followed users (or the sizes given) are
+set on REMOTE users the way cache_users does, with the setter map, and
+the rate is reported in users per second. The loop cache_users used to
+run (every profile on every user, with the setters looked up by
+inspecting User each time) is measured too, on the sizes it can finish.
+"""
+
+import os
+import sys
+import time
+import inspect
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from model.user import User, DataLocations, _set_profiles
+
+
+SIZES = [50, 500, 5000]
+
+# The old loop is far too slow past this.
+LEGACY_MAX = 500
+
+
+def make_profiles(n):
+    """ Returns n profiles keyed by feed link, like get_user_info. """
+    profiles = {}
+    for i in xrange(n):
+        link = 'http://example.com/user{0}/feed.xml'.format(i)
+        profiles[link] = {'username': 'user{0}'.format(i),
+            'user_id': str(i),
+            'user_full_name': 'User {0}'.format(i),
+            'description': 'The profile of user {0}.'.format(i),
+            'link': link,
+            'language': 'en',
+            'lastBuildDate': 'Thu, 07 May 2015 12:02:30 +0000'}
+    return profiles
+
+
+def make_users(profiles):
+    return [User(remote_url=link) for link in profiles]
+
+
+def legacy_set_profiles(users, profiles):
+    """ The loop cache_users used to run, for comparison. """
+    user_dicts = list(profiles.itervalues())
+    for user in users:
+        for i, user_dict in enumerate(user_dicts):
+            user_methods = inspect.getmembers(User, predicate=inspect.ismethod)
+            user._status = DataLocations.CACHED
+            for key, value in user_dict.iteritems():
+                for name, method in user_methods:
+                    is_setter = name[0:3] == 'set'
+                    is_bound_to_key = False
+                    try:
+                        is_bound_to_key = method.binding == key
+                    except AttributeError as e:
+                        pass
+                    if is_setter and is_bound_to_key:
+                        method(user, value)
+                        break
+
+
+def benchmark(setter, profiles):
+    """ Returns the number of users the setter fills in per second. """
+    users = make_users(profiles)
+    b = time.time()
+    setter(users, profiles)
+    e = time.time()
+    return len(users) / max(e - b, 1e-9)
+
+
+def main(sizes):
+    print '{0:>8} {1:>16} {2:>16}'.format('users', 'setter map', 'old loop')
+    for n in sizes:
+        profiles = make_profiles(n)
+        users = make_users(profiles)
+        _set_profiles(users, profiles)
+        assert all(user.username == profiles[user._feed_url]['username']
+                for user in users)
+
+        ops = benchmark(_set_profiles, profiles)
+        if n <= LEGACY_MAX:
+            legacy = '{0:>12,.0f} /s'.format(benchmark(legacy_set_profiles, profiles))
+        else:
+            legacy = '{0:>14}'.format('skipped')
+        print '{0:>8} {1:>12,.0f} /s {2}'.format(n, ops, legacy)
+
+
+if __name__ == '__main__':
+    main([int(n) for n in sys.argv[1:]] or SIZES)
@@ -0,0 +1,112 @@
+""" Measures how fast OnDemandCrawler.on_item collects items.
+
+Usage: python bin/crawler_speedtest.py [n ...]
+
+Feeds of 100, 1000 and 10000 items (or the sizes given) are fed to
+on_item, both in posting order (the order feeds are written in) and
+shuffled, and the rate is reported in items per second. The list insert
+that on_item used to do is measured too, on the sizes it can finish.
+"""
+
+import os
+import sys
+import time
+import random
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from crawler.crawler import OnDemandCrawler
+from pubdate import item_epoch
+
+
+SIZES = [100, 1000, 10000]
+LINK = 'http://example.com/feed.xml'
+INFO = {'username': 'john.cleese', 'link': LINK}
+DATE_STR_FORMAT = '%a, %d %b %Y %H:%M:%S +0000'
+
+# The old insert is far too slow past this.
+LEGACY_MAX = 1000
+
+
+def make_items(n, shuffle=False):
+    """ Returns n items a minute apart, oldest first unless shuffled. """
+    start = datetime(2015, 3, 12, 5, 33, 41)
+    items = [{'guid': str(i),
+        'description': 'Status {0}'.format(i),
+        'pubdate': (start + timedelta(minutes=i)).strftime(DATE_STR_FORMAT)}
+        for i in xrange(n)]
+    if shuffle:
+        random.shuffle(items)
+    return items
+
+
+def legacy_on_item(data, link, info, new_item):
+    """ The list insert on_item used to do, for comparison. """
+    new_item['user'] = info
+    new_epoch = item_epoch(new_item)
+    items = data[link]
+    index = [data[link].index(item) for item in items \
+            if item_epoch(item) < new_epoch]
+    if len(index) == 0:
+        data[link].insert(0, new_item)
+    else:
+        data[link].insert(index[0], new_item)
+    if len(data[link]) > 1000:
+        data[link] = data[link][0:999]
+
+
+def collect(crawler, items):
+    """ Feeds the items to the crawler's on_item and returns the newest
+    first list. """
+    crawler._data = {LINK: []}
+    for item in items:
+        crawler.on_item(LINK, INFO, item)
+    return OnDemandCrawler.newest_items(crawler._data[LINK])
+
+
+def collect_legacy(crawler, items):
+    data = {LINK: []}
+    for item in items:
+        legacy_on_item(data, LINK, INFO, item)
+    return data[LINK]
+
+
+def benchmark(collector, crawler, items):
+    """ Returns the number of items the collector takes in per second. """
+    # Parse the pubdates up front, like the crawler does, so only the
+    # collecting is measured.
+    for item in items:
+        item_epoch(item)
+    b = time.time()
+    collector(crawler, items)
+    e = time.time()
+    return len(items) / max(e - b, 1e-9)
+
+
+def main(sizes):
+    # The crawler starts a process pool, so make one up front (outside
+    # of the timings) and close it when done.
+    crawler = OnDemandCrawler()
+    try:
+        print '{0:>8} {1:>10} {2:>16} {3:>16}'.format('items', 'order', 'on_item', 'old insert')
+        for n in sizes:
+            for shuffle in (False, True):
+                items = make_items(n, shuffle)
+                newest = collect(crawler, [dict(item) for item in items])
+                assert len(newest) == min(n, OnDemandCrawler.max_items)
+                assert newest[0]['guid'] == str(n - 1)
+
+                ops = benchmark(collect, crawler, [dict(item) for item in items])
+                if n <= LEGACY_MAX:
+                    legacy = '{0:>12,.0f} /s'.format(benchmark(collect_legacy, crawler,
+                        [dict(item) for item in items]))
+                else:
+                    legacy = '{0:>14}'.format('skipped')
+                print '{0:>8} {1:>10} {2:>12,.0f} /s {3}'.format(n,
+                        'shuffled' if shuffle else 'posted', ops, legacy)
+    finally:
+        crawler.stop(now=True)
+
+
+if __name__ == '__main__':
+    main([int(n) for n in sys.argv[1:]] or SIZES)
@@ -1,19 +1,73 @@
-""" Tests the speed of the dateutil parser. """
+""" Compares the speed of the dateutil parser and the pubdate parser.
 
-import timeit
+Usage: python bin/dateparser_speedtest.py [feed.xml ...]
 
-from dateutil.parser import parse
+The corpus is made of the pubdates in the given feeds (test/user/feed.xml
+by default) plus a set of dates in the shapes seen in real feeds.
+"""
+
+import os
+import sys
 import time
 
-date_str = 'Mon, 29 Dec 2014 16:45:00'
-avg = 0.0
-runs = 100000
-for x in range(runs):
+from dateutil.parser import parse
+from lxml import etree
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from pubdate import parse_pubdate
+
+
+SAMPLE_DATES = [
+        'Mon, 29 Dec 2014 16:45:00',
+        'Mon, 29 Dec 2014 16:45:00 +0000',
+        'Thu, 12 Mar 2015 05:33:41 +0000',
+        'Wed, 08 Apr 2015 21:25:41 -0700',
+        'Sat, 30 May 2015 09:03:00 GMT',
+        'Fri, 1 May 2015 8:00:00 +0530',
+        'Tue, 02 Jun 2015 17:12:09 UTC',
+        # Odd shapes that fall back to dateutil.
+        'Thu, May 7 2015 12:02:30 +0000',
+        '2015-05-07T12:02:30Z',
+        ]
+
+RUNS = 100000
+
+
+def load_corpus(feeds):
+    """ Collects the pubdates from the given feeds and the samples. """
+    corpus = list(SAMPLE_DATES)
+    for feed in feeds:
+        tree = etree.parse(feed)
+        corpus += [el.text for el in tree.xpath('//item/pubdate') if el.text]
+    return corpus
+
+
+def benchmark(parser, corpus, runs=RUNS):
+    """ Returns the number of dates the parser can parse per second. """
+    n = len(corpus)
     b = time.time()
-    dt = parse(date_str)
+    for x in xrange(runs):
+        parser(corpus[x % n])
     e = time.time()
-    avg += (e - b)
-avg /= runs
-print 'Runs: '+ str(runs)  + '\nAverage Time: '
-print '\tSeconds: ' + str(avg)
-print '\tMilliseconds: ' + str(avg * 1000)
+    return runs / (e - b)
+
+
+def main(feeds):
+    corpus = load_corpus(feeds)
+
+    # Both parsers must agree on every date in the corpus.
+    for date_str in corpus:
+        if parse_pubdate(date_str) != parse(date_str):
+            print 'Mismatch: {0}'.format(date_str)
+
+    print 'Corpus: {0} dates\nRuns: {1}\n'.format(len(corpus), RUNS)
+    dateutil_ops = benchmark(parse, corpus)
+    pubdate_ops = benchmark(parse_pubdate, corpus)
+    print 'dateutil.parser.parse:\t{0:>12,.0f} ops/s'.format(dateutil_ops)
+    print 'pubdate.parse_pubdate:\t{0:>12,.0f} ops/s'.format(pubdate_ops)
+    print 'Speedup:\t\t{0:>12.1f}x'.format(pubdate_ops / dateutil_ops)
+
+
+if __name__ == '__main__':
+    default_feed = os.path.join(os.path.dirname(__file__), '..', 'test', 'user', 'feed.xml')
+    main(sys.argv[1:] or [default_feed])
@@ -1,9 +1,11 @@
 """ Manages the CRUD of the app cache.
 
 The app cache can store a number of things:
-    - the main user's timeline (the most
-        recent 1000 posts)
-    - users (TODO)
+    - the timeline (the most recent 1000 posts
+        of the feeds the crawler reads, kept in
+        timeline.db)
+    - the profiles of the feeds the crawler reads
+        (kept in timeline.db, keyed by feed link)
     - images (TODO)
 
 For all methodss, the cache will return None,
@@ -12,9 +14,15 @@ problem.
 """
 
 
-import os, json
+import os, json, time, threading
 from util import to_cache, from_cache
-from dateutil.parser import parse
+from pubdate import item_epoch
+from timelinestore import SQLiteTimelineStore
+
+
+# The key the crawler stores the link of the feed an item was read from
+# under, so timelines can be limited to the feeds a user follows.
+FEED_LINK_KEY = 'feed_link'
 
 
 class CacheManager():
@@ -23,6 +31,11 @@ class CacheManager():
     cache_location = None
     cache_file_location = None
     cached_post_count = 0
+    timeline_store = None
+    max_timeline_size = 1000
+    # Profiles are refreshed on every crawl of their feed, so one this
+    # old is from a feed the crawler no longer reads.
+    max_profile_age = 7 * 24 * 60 * 60
 
     # Init/Destroy
 
@@ -33,7 +46,8 @@ class CacheManager():
 
         Cache location should be a dir to store all cache files. """
         CacheManager.cache_location = None       # The dir that holds the whole cache.
-        CacheManager.cache_file_location = None  # The JSON file that contains posts, etc.
+        CacheManager.cache_file_location = None  # The JSON file that contains users, etc.
+        CacheManager.timeline_store = None       # The store that contains the timeline.
 
         if cache_location is not None:
             CacheManager.create_cache(cache_location)
@@ -55,9 +69,12 @@ class CacheManager():
         if location[-1] != '/':
             location += '/'
         CacheManager.cache_file_location = location + 'cache.json'
+        CacheManager.timeline_store = SQLiteTimelineStore(location + 'timeline.db',
+                max_items=CacheManager.max_timeline_size)
 
         # Does the cache already exist?
         if os.path.isfile(CacheManager.cache_file_location):
+            CacheManager._migrate_json_timeline()
             return
         # Write the empty cache.
         cache_data = {
@@ -67,6 +84,16 @@ class CacheManager():
         with open(CacheManager.cache_file_location, 'w') as f:
             f.write(json.dumps(cache_data))
 
+    @staticmethod
+    def _migrate_json_timeline():
+        """ Moves a timeline left in cache.json by older versions into
+        the timeline store. """
+        timeline = from_cache(CacheManager.cache_file_location, 'timeline')
+        if not timeline:
+            return
+        CacheManager.add_many_to_timeline(timeline)
+        to_cache(CacheManager.cache_file_location, 'timeline', [])
+
     @staticmethod
     def destroy_cache():
         """ Destroys the stored cache. The file will be deleted. """
@@ -84,56 +111,172 @@ class CacheManager():
     @staticmethod
     def get_timeline(start_id=None, n=0):
         """ Retrieves the main user's cached timeline.
-        In reverse chronological order. """
-        full_timeline = from_cache(CacheManager.cache_file_location, 'timeline')
+        In reverse chronological order.
 
+        Starting at the post with start_id, fetches n posts (including
+        that post). Negative n for the posts before it. Zero for only
+        the post with the given id. Without a start_id, the newest 25
+        (or n) posts are returned. """
         # By default, return the first 25 items.
         if start_id is None:
-            return full_timeline[:25]
+            return CacheManager.get_timeline_page(25 if not n else abs(n))
 
-        starting_item = [item for item in full_timeline if item['guid'] == starting_id]
-        index = 0
-        if len(starting_item) > 0:
-            index = full_timeline.index(starting_item)
-
-        # If no n is provided return max 25 items after the given one.
+        # If no n is provided return max 25 items starting at the given one.
         if n is None:
-            end = 25
-            if len(full_timeline[index:]) < 25:
-                end = len(full_timeline[index:])
-            return full_timeline[index:end]
+            return CacheManager.timeline_store.after(start_id, 25, inclusive=True)
 
         # Return n items (forward or back) from the given point.
         if n == 0:
-            return [full_timeline[index]]
+            status = CacheManager.timeline_store.get(start_id)
+            return [status] if status is not None else []
         elif n < 0:
-            full_timeline = reversed(full_timeline)
+            return CacheManager.get_timeline_before(start_id, abs(n))
+        return CacheManager.timeline_store.after(start_id, n, inclusive=True)
 
-        return full_timeline[:abs(n)]
+    @staticmethod
+    def get_timeline_page(n=25, links=None):
+        """ Returns the newest n posts in the timeline. If links is
+        given, only the posts read from those feeds are returned. """
+        return CacheManager.timeline_store.page(0, n, links=links)
 
+    @staticmethod
+    def get_timeline_after(status_id, n=25, links=None):
+        """ Returns the next n posts after (older than) the post with
+        the given status_id. Use the last post's guid on a page as the
+        cursor for the next page. If links is given, only the posts
+        read from those feeds are returned. """
+        return CacheManager.timeline_store.after(status_id, n, links=links)
+
+    @staticmethod
+    def get_timeline_before(status_id, n=25, links=None):
+        """ Returns the n posts before (newer than) the post with the
+        given status_id, in reverse chronological order. Use the first
+        post's guid on a page as the cursor for the previous page. If
+        links is given, only the posts read from those feeds are
+        returned. """
+        return CacheManager.timeline_store.before(status_id, n, links=links)
+
+    @staticmethod
+    def _seen_key(status):
+        """ Returns the (author link, guid) that identifies the post,
+        or None if the post has no guid. """
+        guid = status.get('guid')
+        if guid is None:
+            return None
+        return (status.get('user') or {}).get('link'), guid
+
+    @staticmethod
+    def _feed_link(status):
+        """ Returns the link of the feed the post was read from: the
+        FEED_LINK_KEY the crawler sets, or else the author's link. """
+        return status.get(FEED_LINK_KEY) or (status.get('user') or {}).get('link')
+
+    @staticmethod
+    def is_cached(status):
+        """ Checks if the post has been added to the timeline. Posts
+        older than the whole timeline are eventually forgotten. """
+        key = CacheManager._seen_key(status)
+        return key is not None and CacheManager.timeline_store.is_seen(key)
 
     @staticmethod
     def add_to_timeline(new_status):
         """ Caches the given post in the user's
         timeline. The post is inserted reverse
-        chronologically. """
-        timeline = CacheManager.get_timeline()
-        index = [timeline.index(status) for status in timeline \
-                if parse(status['pubdate']) < parse(new_status['pubdate'])]
-        if len(index) == 0:
-            timeline.insert(0, new_status)
-        else:
-            timeline.insert(index[0], new_status)
+        chronologically. Posts that have already been
+        cached are skipped. Returns True if the post
+        was added. """
+        return CacheManager.add_many_to_timeline([new_status]) == 0
 
-        if len(timeline) > 1000:
-            timeline = timeline[0:999]
-        to_cache(CacheManager.cache_file_location, 'timeline', timeline)
+    @staticmethod
+    def add_many_to_timeline(new_stati):
+        """ Caches all of the given posts in the user's timeline
+        with a single write. Posts that have already been cached,
+        or are older than the whole timeline, are skipped. Returns
+        the number of skipped posts. """
+        items = [(status, item_epoch(status), CacheManager._feed_link(status),
+            CacheManager._seen_key(status)) for status in new_stati]
+        if not items:
+            return 0
+        return len(items) - CacheManager.timeline_store.add_many(items)
+
+    @staticmethod
+    def timeline_writer(max_items=500, max_seconds=10):
+        """ Returns a TimelineWriter that buffers posts and adds them
+        to the timeline in batches. """
+        return TimelineWriter(max_items=max_items, max_seconds=max_seconds)
 
     @staticmethod
     def remove_from_timeline(status_id):
         """ Removes the post with the given status_id
         from the user's cached timeline. """
-        timeline = [status for status in CacheManager.get_timeline \
-                if status['guid'] != status_id]
-        to_cache(CacheManager.cache_file_location, 'timeline', timelinE)
+        CacheManager.timeline_store.remove(status_id)
+
+    # Profiles
+
+    @staticmethod
+    def get_profiles(links):
+        """ Returns the cached profiles (the channel info of each feed)
+        of the given feed links, as a dict keyed by link. Feeds that have
+        not been crawled yet, or not in max_profile_age seconds, are left
+        out. """
+        if CacheManager.timeline_store is None:
+            return {}
+        return CacheManager.timeline_store.profiles(links, CacheManager.max_profile_age)
+
+    @staticmethod
+    def cache_profiles(profiles):
+        """ Caches the given profiles, a dict keyed by feed link, and
+        drops the ones older than max_profile_age. """
+        CacheManager.timeline_store.set_profiles(profiles, CacheManager.max_profile_age)
+
 
+class TimelineWriter(object):
+    """ Buffers posts bound for the cached timeline and writes them
+    with CacheManager.add_many_to_timeline(). The buffer is flushed
+    once it holds max_items posts, once max_seconds have passed since
+    the last flush, when flush() is called, or when used as a context
+    manager, on exit.
+
+    Posts that are already cached are rejected as they are added and
+    counted in skipped_count. """
+
+    def __init__(self, max_items=500, max_seconds=10):
+        self.max_items = max_items
+        self.max_seconds = max_seconds
+        self.flush_count = 0
+        self.skipped_count = 0
+        self._buffer = []
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def add(self, status):
+        """ Buffers the given post, flushing if a threshold is reached.
+        Returns False if the post was skipped because it is already cached. """
+        with self._lock:
+            if CacheManager.is_cached(status):
+                self.skipped_count += 1
+                return False
+            self._buffer.append(status)
+            if len(self._buffer) >= self.max_items \
+                    or time.time() - self._last_flush >= self.max_seconds:
+                self._flush()
+            return True
+
+    def flush(self):
+        """ Writes all buffered posts to the timeline. """
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._last_flush = time.time()
+        if not self._buffer:
+            return
+        stati, self._buffer = self._buffer, []
+        self.skipped_count += CacheManager.add_many_to_timeline(stati)
+        self.flush_count += 1
@@ -30,10 +30,14 @@ from crontab import CronTab
 # Configuration
 CACHE = '/tmp/microblog/'
 SETTINGS = '~{0}/.microblogger_settings.json'
+SETTINGS_DB = '~{0}/.microblogger_settings.db'
 ROOT_DIR = '/var/www/microblogger/'
 DEFAULT_TIMELINE_SIZE = 25
 MAX_FILE_SIZE_BYTES = 500000
 MAX_POSTS_PER_FEED = 500
+# How feeds are sent: 'wsgi' (wsgi.file_wrapper) or 'x-sendfile'
+# (Apache's mod_xsendfile, see bin/httpd.conf-addition).
+SEND_FILE_MODE = 'wsgi'
 
 
 class bcolors:
@@ -107,8 +111,11 @@ def main():
     SettingsManager.add('max_feed_size_bytes', MAX_FILE_SIZE_BYTES)
     SettingsManager.add('max_posts_per_feed', MAX_POSTS_PER_FEED)
     SettingsManager.add('cache_location', CACHE)
+    SettingsManager.add('send_file_mode', SEND_FILE_MODE)
     # Create a secret key.
     SettingsManager.add('secret', os.urandom(64).encode('base-64'))
+    # Move the settings and user registry into SQLite.
+    SettingsManager.migrate_to_sqlite(os.path.expanduser(SETTINGS_DB.format(user)))
 
     print '    {0}OK{1}'.format(bcolors.OKGREEN, bcolors.ENDC)
 
@@ -2,10 +2,12 @@
 
 from microblogcrawler.crawler import FeedCrawler
 from util import from_settings
-from cachemanager import CacheManager
+from cachemanager import CacheManager, FEED_LINK_KEY
 
 import time
-from dateutil.parser import parse
+import heapq
+from itertools import count
+from pubdate import item_epoch
 
 
 class MicroblogFeedCrawler(FeedCrawler):
@@ -22,42 +24,82 @@ class MicroblogFeedCrawler(FeedCrawler):
         if cache_location is None:
             raise ValueError('Cache location is required for multiprocessed crawling.')
         CacheManager(cache_location)
+        # Batch the timeline writes for each crawl cycle.
+        self._timeline_writer = CacheManager.timeline_writer()
+        # The profile of each feed read this crawl cycle, keyed by link.
+        self._profiles = {}
         # Call the superclass init.
         FeedCrawler.__init__(self, links, start_now=start_now, deep_traverse=deep_traverse)
 
     def on_item(self, link, info, item):
         """ Store new items in the cache. """
         item['user'] = info
-        CacheManager.add_to_timeline(item)
+        item[FEED_LINK_KEY] = link
+        self._profiles[link] = info
+        self._timeline_writer.add(item)
         print item['description'] + '\n'
 
+    def on_finish(self):
+        """ Writes the items and profiles found this crawl cycle to
+        the cache. """
+        self._timeline_writer.flush()
+        if self._profiles:
+            CacheManager.cache_profiles(self._profiles)
+            self._profiles = {}
+        if self._timeline_writer.skipped_count > 0:
+            print 'Skipped {0} already cached items.\n'.format(
+                    self._timeline_writer.skipped_count)
+        self._timeline_writer.skipped_count = 0
+
+    def on_shutdown(self):
+        """ Writes any remaining items to the cache. """
+        self._timeline_writer.flush()
+
 
 class OnDemandCrawler(FeedCrawler):
     """ A crawler that returns the data for each
     feed once the entire set of links is parsed.
 
     The callback recieves a dict of the data.
+
+    While crawling, the newest max_items items of each link are kept in a
+    min-heap keyed by their pre-parsed pubdate, so each item costs one
+    heap push (and pop, once the heap is full). The heaps are turned into
+    lists, newest first, when the crawl is done.
     """
 
+    max_items = 1000
+
     def __init__(self):
         self._data = {}
+        self._order = count()
         FeedCrawler.__init__(self, [], start_now=False, deep_traverse=False)
 
     def get_all_items(self, links, deep_traverse=False):
         """ Does the crawling and returns when the crawling is done. """
-        self._deep_traverse = deep_traverse
-        for link in links:
-            self._data[link] = []
-        self.start(links)
+        self._crawl(links, deep_traverse)
         return self._data
 
     def get_user_info(self, links, deep_traverse=False):
-        """ Returns a list of all of the profiles of the given users. """
+        """ Returns the profiles of the given users' feeds, as a dict
+        keyed by feed link. Feeds with no items are left out. """
+        self._crawl(links, deep_traverse)
+        return dict((link, self._data[link][0]['user']) for link in links
+                if self._data.get(link))
+
+    def _crawl(self, links, deep_traverse):
+        """ Crawls the links and collects their items into self._data. """
         self._deep_traverse = deep_traverse
         for link in links:
             self._data[link] = []
         self.start(links)
-        return [self._data[link][0]['user'] for link in links]
+        self._data = dict((link, self.newest_items(heap))
+                for link, heap in self._data.iteritems())
+
+    @staticmethod
+    def newest_items(heap):
+        """ Returns the items in the heap, newest first. """
+        return [item for epoch, order, item in sorted(heap, reverse=True)]
 
     def on_finish(self):
         """ Stops the crawler. """
@@ -66,16 +108,12 @@ class OnDemandCrawler(FeedCrawler):
     def on_item(self, link, info, new_item):
         """ Add the item field to the link's dict. """
         new_item['user'] = info
-        items = self._data[link]
-        # Reverse sort by time.
-        index = [self._data[link].index(item) for item in items \
-                if parse(item['pubdate']) < parse(new_item['pubdate'])]
-        if len(index) == 0:
-            self._data[link].insert(0, new_item)
-        else:
-            self._data[link].insert(index[0], new_item)
-        # Only keep the last 1000
-        if len(self._data[link]) > 1000:
-            self._data[link]= self._data[link][0:999]
-
-
+        # Of items with the same pubdate, the ones found first are
+        # treated as newer.
+        entry = (item_epoch(new_item), -next(self._order), new_item)
+        heap = self._data.setdefault(link, [])
+        # Only keep the newest max_items.
+        if len(heap) < self.max_items:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
@@ -0,0 +1,115 @@
+""" A persistent index of where each item of a feed lives.
+
+A user's feed is split across the head feed and its archive pages, so
+finding one item used to mean parsing every page in turn. The index maps
+each item's key (the guid of a post, or the user_link of a follows or
+blocks entry) to the page file that holds it and the item's position on
+that page, so an item can be found with one lookup and one page parse.
+
+Each feed has its own index, stored in a SQLite file next to it
+(feed.xml.index.db). Get it with util.get_feed_index().
+"""
+
+from sqlitestore import SQLiteStore
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS items (
+    key TEXT PRIMARY KEY,
+    page TEXT NOT NULL,
+    position INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_page ON items (page, position);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+# Marks an index that has been built from every page of its feed.
+BUILT_KEY = 'built'
+
+
+class SQLiteFeedIndex(SQLiteStore):
+    """ Maps item keys to (page, position) in a SQLite database. """
+
+    SCHEMA = SCHEMA
+
+    # Reading
+
+    def is_built(self):
+        """ Returns True once the index has been built from the feed. """
+        return self._connection().execute(
+                'SELECT 1 FROM state WHERE key = ?', (BUILT_KEY,)).fetchone() is not None
+
+    def lookup(self, key):
+        """ Returns the (page, position) of the item with the given key,
+        or None if it is not indexed. """
+        row = self._connection().execute(
+                'SELECT page, position FROM items WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            return row[0], row[1]
+
+    def count(self):
+        return self._connection().execute('SELECT COUNT(*) FROM items').fetchone()[0]
+
+    # Writing
+
+    def add(self, key, page, position):
+        """ Records that the item with the given key is at position on
+        the given page. """
+        conn = self._connection()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO items (key, page, position) VALUES (?, ?, ?)',
+                    (key, page, position))
+
+    def _index_page(self, conn, page, keys):
+        conn.execute('DELETE FROM items WHERE page = ?', (page,))
+        conn.executemany('INSERT OR REPLACE INTO items (key, page, position) VALUES (?, ?, ?)',
+                ((key, page, position) for position, key in enumerate(keys)
+                    if key is not None))
+
+    def index_page(self, page, keys):
+        """ Replaces the entries of the given page with the given keys,
+        in the order they appear on the page. """
+        conn = self._connection()
+        with conn:
+            self._index_page(conn, page, keys)
+
+    def rebuild(self, pages):
+        """ Rebuilds the whole index from (page, keys) pairs, oldest page
+        first, and marks it as built. """
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM items')
+            for page, keys in pages:
+                self._index_page(conn, page, keys)
+            conn.execute('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)',
+                    (BUILT_KEY, '1'))
+
+    def move_page(self, page, new_page):
+        """ Points every entry of the given page at new_page (i.e. when
+        the page is archived). Positions are kept. """
+        conn = self._connection()
+        with conn:
+            conn.execute('UPDATE items SET page = ? WHERE page = ?', (new_page, page))
+
+    def remove(self, key):
+        """ Removes the item with the given key, and moves the items after
+        it on its page up by one. """
+        conn = self._connection()
+        with conn:
+            row = conn.execute('SELECT page, position FROM items WHERE key = ?',
+                    (key,)).fetchone()
+            if row is None:
+                return
+            page, position = row
+            conn.execute('DELETE FROM items WHERE key = ?', (key,))
+            conn.execute('UPDATE items SET position = position - 1 '
+                    'WHERE page = ? AND position > ?', (page, position))
+
+    def clear(self):
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM items')
+            conn.execute('DELETE FROM state WHERE key = ?', (BUILT_KEY,))
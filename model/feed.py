@@ -12,17 +12,22 @@ standard-version: 0.5
 from lxml import etree
 from defusedxml import lxml
 
+from xpaths import CHILD
+
 
 class MalformedFeedError(Exception):
     pass
 
 
+def _find(element, attr):
+    """ Returns the first child of the element with the given name (with
+    or without the microblog: prefix), or None. """
+    found = CHILD[attr](element)
+    return found[0] if found else None
+
+
 # Feed Model
 
-MICROBLOG_NAMESPACE = 'microblog'
-NSMAP = {
-        MICROBLOG_NAMESPACE: 'http://openmicroblog.com/',
-    }
 
 class Feed(object):
     """ The base object that represents an XML feed. """
@@ -52,9 +57,7 @@ class MainFeed(Feed):
 
         for attr in self.REQUIRED_RSS_ELEMENTS:
             try:
-                value = self._tree.find('{attr}'.format(ns=MICROBLOG_NAMESPACE,
-                        attr=attr),
-                    namespaces=NSMAP).text
+                value = _find(self._tree, attr).text
             except AttributeError:
                 raise MalformedFeedError(
                         'Feed must contain all required elements: {} is missing.'\
@@ -62,17 +65,13 @@ class MainFeed(Feed):
             setattr(self, attr, value)
 
         for attr in self.OPTIONAL_RSS_ELEMENTS:
-            value = self._tree.find('{attr}'.format(ns=MICROBLOG_NAMESPACE,
-                    attr=attr),
-                namespaces=NSMAP)
+            value = _find(self._tree, attr)
             if value is not None:
                 setattr(self, attr, value)
 
         for attr in self.REQUIRED_MICROBLOG_ELEMENTS:
             try:
-                value = self._tree.find('{ns}:{attr}'.format(ns=MICROBLOG_NAMESPACE,
-                        attr=attr),
-                    namespaces=NSMAP).text
+                value = _find(self._tree, attr).text
             except AttributeError:
                 if not allow_rss:
                     raise MalformedFeedError(
@@ -81,14 +80,12 @@ class MainFeed(Feed):
             setattr(self, attr, value)
 
         for attr in self.OPTIONAL_MICROBLOG_ELEMENTS:
-            value = self._tree.find('{ns}:{attr}'.format(ns=MICROBLOG_NAMESPACE,
-                    attr=attr),
-                namespaces=NSMAP)
+            value = _find(self._tree, attr)
             if value is not None:
                 setattr(self, attr, value)
 
-        for element in tree.xpath('//item'):
-            self.items.append(MainFeedItem(etree.tostring(element)))
+        for element in CHILD['item'](tree):
+            self.items.append(MainFeedItem(element=element))
 
     def __iter__(self):
         return iter(self.items)
@@ -114,8 +111,10 @@ class UserFeed(Feed):
 class Item(object):
     """ The base object that represents a generic item in a feed. """
 
-    def __init__(self, raw_text=''):
-        self._tree = lxml.fromstring(raw_text)
+    def __init__(self, raw_text='', element=None):
+        """ Parses the item from its raw text, or wraps an element that
+        has already been parsed (i.e. as part of its feed). """
+        self._tree = element if element is not None else lxml.fromstring(raw_text)
 
 class MainFeedItem(Item):
     """ Models an item found in the main feed representing
@@ -129,15 +128,13 @@ class MainFeedItem(Item):
             'in_reply_to_status_id', 'reposted_status_user_id', 'reposted_user_link',
             'reposted_status_id', 'reposted_status_pubdate', 'language'}
 
-    def __init__(self, raw_text=''):
-        super(self.__class__, self).__init__(raw_text)
+    def __init__(self, raw_text='', element=None):
+        super(self.__class__, self).__init__(raw_text, element)
         self.items = []
 
         for attr in self.REQUIRED_RSS_ELEMENTS:
             try:
-                value = self._tree.find('{attr}'.format(ns=MICROBLOG_NAMESPACE,
-                        attr=attr),
-                    namespaces=NSMAP).text
+                value = _find(self._tree, attr).text
             except AttributeError:
                 raise MalformedFeedError(
                         'Feed must contain all required elements: {} is missing.'\
@@ -145,17 +142,13 @@ class MainFeedItem(Item):
             setattr(self, attr, value)
 
         for attr in self.OPTIONAL_RSS_ELEMENTS:
-            value = self._tree.find('{attr}'.format(ns=MICROBLOG_NAMESPACE,
-                    attr=attr),
-                namespaces=NSMAP)
+            value = _find(self._tree, attr)
             if value is not None:
                 setattr(self, attr, value)
 
         for attr in self.REQUIRED_MICROBLOG_ELEMENTS:
             try:
-                value = self._tree.find('{ns}:{attr}'.format(ns=MICROBLOG_NAMESPACE,
-                        attr=attr),
-                    namespaces=NSMAP).text
+                value = _find(self._tree, attr).text
             except AttributeError:
                 raise MalformedFeedError(
                         'Feed must contain all required elements: {} is missing.'\
@@ -163,9 +156,7 @@ class MainFeedItem(Item):
             setattr(self, attr, value)
 
         for attr in self.OPTIONAL_MICROBLOG_ELEMENTS:
-            value = self._tree.find('{ns}:{attr}'.format(ns=MICROBLOG_NAMESPACE,
-                    attr=attr),
-                namespaces=NSMAP)
+            value = _find(self._tree, attr)
             if value is not None:
                 setattr(self, attr, value)
 
@@ -180,15 +171,13 @@ class UserFeedItem(Item):
     REQUIRED_MICROBLOG_ELEMENTS = {}
     OPTIONAL_MICROBLOG_ELEMENTS = {'user_id', 'username', 'user_link'}
 
-    def __init__(self, raw_text=''):
-        super(self.__class__, self).__init__(raw_text)
+    def __init__(self, raw_text='', element=None):
+        super(self.__class__, self).__init__(raw_text, element)
         self.items = []
 
         for attr in self.REQUIRED_RSS_ELEMENTS:
             try:
-                value = self._tree.find('{attr}'.format(ns=MICROBLOG_NAMESPACE,
-                        attr=attr),
-                    namespaces=NSMAP).text
+                value = _find(self._tree, attr).text
             except AttributeError:
                 raise MalformedFeedError(
                         'Feed must contain all required elements: {} is missing.'\
@@ -196,17 +185,13 @@ class UserFeedItem(Item):
             setattr(self, attr, value)
 
         for attr in self.OPTIONAL_RSS_ELEMENTS:
-            value = self._tree.find('{attr}'.format(ns=MICROBLOG_NAMESPACE,
-                    attr=attr),
-                namespaces=NSMAP)
+            value = _find(self._tree, attr)
             if value is not None:
                 setattr(self, attr, value)
 
         for attr in self.REQUIRED_MICROBLOG_ELEMENTS:
             try:
-                value = self._tree.find('{ns}:{attr}'.format(ns=MICROBLOG_NAMESPACE,
-                        attr=attr),
-                    namespaces=NSMAP).text
+                value = _find(self._tree, attr).text
             except AttributeError:
                 raise MalformedFeedError(
                         'Feed must contain all required elements: {} is missing.'\
@@ -214,9 +199,7 @@ class UserFeedItem(Item):
             setattr(self, attr, value)
 
         for attr in self.OPTIONAL_MICROBLOG_ELEMENTS:
-            value = self._tree.find('{ns}:{attr}'.format(ns=MICROBLOG_NAMESPACE,
-                    attr=attr),
-                namespaces=NSMAP)
+            value = _find(self._tree, attr)
             if value is not None:
                 setattr(self, attr, value)
 
@@ -1,6 +1,6 @@
 """ A model for a user's post. """
 
-from dateutil.parser import parse
+from pubdate import parse_pubdate, to_epoch, from_epoch, EPOCH_KEY
 from lxml.builder import E
 from lxml.etree import CDATA
 from datetime import datetime
@@ -51,20 +51,24 @@ class Status(object):
             self.status_type = status_type if status_type is not None \
                 else self._determine_status_type()
 
+            # Items from the crawler carry their pre-parsed pubdate.
             if isinstance(entries.get('pubdate'), datetime):
                 self.pubdate = entries.get('pubdate')
+            elif entries.get(EPOCH_KEY) is not None:
+                self.pubdate = from_epoch(entries.get(EPOCH_KEY))
             else:
-                self.pubdate = parse(entries.get('pubdate'))
+                self.pubdate = parse_pubdate(entries.get('pubdate'))
 
             if self.status_type == StatusType.REPOST:
-                self.reposted_status_pubdate = parse(self.reposted_status_pubdate)
+                self.reposted_status_pubdate = parse_pubdate(self.reposted_status_pubdate)
         else:
             # When in doubt, just set to status.
             self.status_type = StatusType.STATUS
 
         # Set the rest of the status up.
         self.user = user
-        self.guid = uuid4().hex[-12:]
+        if self.guid is None:
+            self.guid = uuid4().hex[-12:]
 
 
     # Guid
@@ -86,9 +90,15 @@ class Status(object):
         if not isinstance(pubdate, datetime):
             raise ValueError('pubdate must be a datetime.')
         self.__dict__['pubdate'] = pubdate
+        self.__dict__[EPOCH_KEY] = to_epoch(pubdate)
 
     pubdate = property(get_pubdate, set_pubdate)
 
+    @property
+    def pubdate_epoch(self):
+        """ The pubdate as a UTC epoch. Use this for sorting. """
+        return self.__dict__.get(EPOCH_KEY)
+
     @property
     def readable_pubdate(self):
         tz = timezone('US/Pacific')
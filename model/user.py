@@ -1,80 +1,308 @@
 """ Feed related operations. """
 
-import time
+import os
+import heapq
+from itertools import islice
+from collections import deque
+from contextlib import contextmanager
 
 from lxml.builder import E
 from lxml.etree import CDATA
 from lxml import etree
-from dateutil.parser import parse
 
 import util as u
+from cachemanager import CacheManager
+from pubdate import to_epoch, EPOCH_KEY
 from settingsmanager import SettingsManager
-from status import StatusType, Status, _recursive_dict
+from status import Status, _recursive_dict
+from xpaths import FEED, CHILD, CHANNEL, ITEMS, NSMAP, child_text
 from shared import db
 
 # Misc Utilities
 
 
-def _get_from_feed(rel_location, xpath):
-    """ Gets a given attr from the feed at the location. """
+def _set_to_feed(rel_location, query, value):
+    """ Sets a value to the node found by the query in the file given. """
     feed = u.get_user_feed(rel_location)
-    return feed.xpath(xpath)[0].text
-
-
-def _set_to_feed(rel_location, xpath, value):
-    """ Sets a value to the node at the xpath in the file given. """
-    feed = u.get_user_feed(rel_location)
-    element = feed.xpath(xpath)
-    if element:
-        element[0].text = value
+    _set_to_tree(feed, query, value)
     u.write_user_feed(feed, rel_location)
 
 
-def _del_from_feed(rel_location, xpath):
-    """ Deletes a node found at the given xpath from the feed. """
-    feed = u.get_user_feed(rel_location)
-    element = feed.xpath(xpath)
+def _set_to_tree(tree, query, value):
+    """ Sets a value to the node found by the query in the given tree. """
+    element = query(tree)
     if element:
-        element[0].getparent().remove(element[0])
-    u.write_user_feed(feed, rel_location)
+        element[0].text = value
 
 
 def _write_to_feed(tree, rel_location):
     """ Writes the given tree to the location given. If pagination
     is required, then it will paginate the files. Wraps
     u.write_user_feed() """
-    # Check if the feed is too big. If so, make a new
-    # feed and insert it there.
-    size = u.get_user_feed_size(rel_location)
-    count = len(tree.xpath('//item'))
-    if size > SettingsManager.get('max_feed_size_bytes') \
-            or count > SettingsManager.get('max_posts_per_feed'):
-        old_feed_name = u.archive_user_feed(rel_location)
-        from lxml.builder import E
-        tree.xpath('//channel')[0].append(E.next_node(old_filename))
     u.write_user_feed(tree, rel_location)
+    _feed_index(rel_location).index_page(rel_location,
+            [_item_key(item) for item in ITEMS(tree)])
+    if _is_full(u.get_feed_meta(rel_location)):
+        _paginate(rel_location)
 
 
-def _search_recurs(rel_location, xpath_qry):
-    """ Searches the tree representation of the given file for
-    any item that meets the query string. If not found, it searches
-    the `next_node` until it succeeds or no more `next_nodes` are
-    found.
+def _paginate(rel_location):
+    """ Moves the items in the feed at rel_location to a new archive page.
 
-    Returns a tuple (rel_file_url, guid)
+    The archived page keeps the feed's next_node, so it links to the
+    page archived before it, and the feed's next_node is pointed at the
+    new page. The page is recorded in the feed's page manifest (the
+    'pages' list in its meta, oldest first) with its item count and
+    first/last pubdates.
     """
-    feed = u.get_user_feed(rel_location)
-    item = feed.xpath(xpath_qry)
-    next_node = feed.xpath('//next_node')
-
-    if len(item) > 0:
-        return rel_location, item[0].get('guid')
-    elif next_node:
-        # TODO: DOES NOT WORK
-        new_rel_location = u.convert_url(next_node[0].text, to_relative=True)
-        _search_recurs(new_rel_location, xpath_qry)
+    meta = u.get_feed_meta(rel_location)
+    pages = meta.setdefault('pages', [])
+    page_number = len(pages) + 1
+    archive_location = u.archive_user_feed(rel_location, page_number)
+
+    tree = u.get_user_feed(rel_location)
+    channel = CHANNEL(tree)[0]
+    items = CHILD['item'](channel)
+    pubdates = [to_epoch(pubdate) for pubdate in
+            (child_text(item, 'pubdate') for item in items) if pubdate]
+    for item in items:
+        channel.remove(item)
+
+    # Point the feed at the new page.
+    page_url = _page_url(channel, archive_location)
+    next_node = CHILD['next_node'](channel)
+    if next_node:
+        next_node[0].text = page_url
     else:
-        return
+        channel.append(E.next_node(page_url))
+
+    pages.append({
+        'file': archive_location,
+        'url': page_url,
+        'items': len(items),
+        'first_pubdate': min(pubdates) if pubdates else None,
+        'last_pubdate': max(pubdates) if pubdates else None
+        })
+    u.write_feed_meta(rel_location, meta)
+    _feed_index(rel_location).move_page(rel_location, archive_location)
+    u.write_user_feed(tree, rel_location)
+
+
+def _page_url(channel, archive_location):
+    """ Returns the public url of the archive page. Archive pages are
+    served from the archive/ directory next to the feed's link
+    (i.e. http://domain.tld/username/archive/feed_1.xml). """
+    link = child_text(channel, 'link') or ''
+    if link.endswith('.xml'):
+        link = link.rsplit('/', 1)[0]
+    page_name = archive_location.rsplit('/', 1)[-1]
+    return '/'.join(part for part in (link.rstrip('/'), 'archive', page_name) if part)
+
+
+def _feed_pages(rel_location):
+    """ Returns the page manifest of the feed at rel_location, oldest
+    page first. """
+    return u.get_feed_meta(rel_location, recount=False).get('pages', [])
+
+
+def _overlaps(page, since, until):
+    """ Checks whether the page's pubdate range overlaps [since, until].
+    Either bound may be None. """
+    if page.get('first_pubdate') is None:
+        return False
+    return (since is None or page['last_pubdate'] >= since) \
+            and (until is None or page['first_pubdate'] <= until)
+
+
+def _timeline_items(rel_location, since=None, until=None, n=None):
+    """ Yields the newest n items (all of them if n is None) of the feed
+    at rel_location, and of those of its archive pages whose pubdates
+    overlap [since, until], newest first, as dicts carrying their pubdate
+    epoch. since and until are UTC epochs (or None).
+
+    Each page holds the posts made after the page before it, so the pages
+    are read newest first, and only until n items are found.
+    """
+    pages = [page['file'] for page in reversed(_feed_pages(rel_location))
+            if _overlaps(page, since, until)]
+    for location in [rel_location] + pages:
+        if n is not None and n <= 0:
+            return
+        for item in _page_items(location, since, until, n):
+            if n is not None:
+                n -= 1
+            yield item
+
+
+def _page_items(location, since=None, until=None, n=None):
+    """ Returns the newest n items (all of them if n is None) on the page
+    at location whose pubdates fall in [since, until], newest first.
+
+    The page is streamed with iterparse, and only the newest n items are
+    kept. Items are normally appended in order, so they are kept in a
+    bounded queue and no sort is needed. If an item turns up out of order
+    the rest of the page is sorted through a bounded heap instead.
+    """
+    recent = deque(maxlen=n)
+    heap = None
+    last_epoch = None
+    with open(location, 'r') as f:
+        for position, (event, element) in enumerate(etree.iterparse(f, tag='item')):
+            parent = element.getparent()
+            # Drop what has been read so far. The items that are kept
+            # stay alive through the queue or heap.
+            while element.getprevious() is not None:
+                del parent[0]
+            parent.remove(element)
+
+            epoch = to_epoch(child_text(element, 'pubdate'))
+            if (since is not None and epoch < since) \
+                    or (until is not None and epoch > until):
+                continue
+            if heap is None and last_epoch is not None and epoch < last_epoch:
+                heap = list(recent)
+                heapq.heapify(heap)
+            last_epoch = epoch
+
+            # Later items win ties, since they were posted later.
+            entry = (epoch, position, element)
+            if heap is None:
+                recent.append(entry)
+            elif n is None or len(heap) < n:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heappushpop(heap, entry)
+
+    kept = reversed(recent) if heap is None else sorted(heap, reverse=True)
+    items = []
+    for epoch, position, element in kept:
+        item = _recursive_dict(element)[1]
+        item[EPOCH_KEY] = epoch
+        items.append(item)
+    return items
+
+
+def _as_epoch(value):
+    """ Converts a datetime, pubdate string or epoch to a UTC epoch. """
+    if value is None or isinstance(value, (int, long, float)):
+        return value
+    return to_epoch(value)
+
+
+def _is_full(meta, new_items=0, new_size=0):
+    """ Checks the feed meta against the pagination limits. Pass the
+    count and byte size of items about to be added to check the feed as
+    it will be once they are. """
+    max_size = SettingsManager.get('max_feed_size_bytes')
+    max_items = SettingsManager.get('max_posts_per_feed')
+    return (max_size is not None and meta['size'] + new_size > max_size) \
+            or (max_items is not None and meta['items'] + new_items > max_items)
+
+
+# User Lists
+
+
+USER_LIST_KEYS = ('user_id', 'user_name', 'user_link')
+
+
+def _read_user_list(rel_location):
+    """ Returns the entries of the follows or blocks list at rel_location,
+    and of its archive pages, as dicts of user_id, user_name and
+    user_link. Only the local files are read. """
+    pages = [page['file'] for page in reversed(_feed_pages(rel_location))]
+    entries = []
+    for location in [rel_location] + pages:
+        for item in ITEMS(u.get_user_feed(location, read_only=True)):
+            entry = {}
+            for key in USER_LIST_KEYS:
+                entry[key] = child_text(item, key)
+            entries.append(entry)
+    return entries
+
+
+def _listed_user(entry, profile=None):
+    """ Returns a CACHED user for the user list entry, filled in with
+    the feed's cached profile if there is one. """
+    user_dict = {'user_id': entry['user_id'], 'username': entry['user_name'],
+            'link': entry['user_link']}
+    if profile is not None:
+        user_dict.update((key, value) for key, value in profile.iteritems()
+                if value is not None)
+    return User(entries=user_dict)
+
+
+# Item Index
+
+
+def _item_key(item):
+    """ Returns the key an item is indexed by: the guid of a post, or
+    the user_link of a follows or blocks entry. """
+    return child_text(item, 'guid') or child_text(item, 'user_link')
+
+
+def _feed_index(rel_location):
+    """ Returns the item index of the feed at rel_location. The index is
+    built from the feed and its archive pages the first time. """
+    index = u.get_feed_index(rel_location)
+    if not index.is_built():
+        _rebuild_index(rel_location, index)
+    return index
+
+
+def _rebuild_index(rel_location, index):
+    """ Rebuilds the item index from every page of the feed. """
+    locations = [page['file'] for page in _feed_pages(rel_location)] + [rel_location]
+    pages = []
+    for location in locations:
+        feed = u.get_user_feed(location, read_only=True)
+        pages.append((location, [_item_key(item) for item in ITEMS(feed)]))
+    index.rebuild(pages)
+
+
+def _find_item(rel_location, key, read_only=False):
+    """ Finds the item with the given key in the feed at rel_location,
+    or any of its archive pages, using the feed's item index.
+
+    Returns a tuple (page_location, tree, item), or None. If read_only is
+    True, the tree must not be modified (see u.get_user_feed).
+    """
+    index = _feed_index(rel_location)
+    for attempt in range(2):
+        entry = index.lookup(key)
+        if entry is None:
+            return
+        location, position = entry
+        if os.path.isfile(location):
+            tree = u.get_user_feed(location, read_only=read_only)
+            items = ITEMS(tree)
+            if position < len(items) and _item_key(items[position]) == key:
+                return location, tree, items[position]
+            for item in items:
+                if _item_key(item) == key:
+                    return location, tree, item
+        # The index is out of date (the feed was changed behind its back).
+        _rebuild_index(rel_location, index)
+
+
+def _remove_item(rel_location, key):
+    """ Removes the item with the given key from whichever page of the
+    feed holds it. Returns True if the item was found. """
+    found = _find_item(rel_location, key)
+    if found is None:
+        return False
+    location, tree, item = found
+    item.getparent().remove(item)
+    u.write_user_feed(tree, location)
+    _feed_index(rel_location).remove(key)
+
+    if location != rel_location:
+        # Keep the page manifest's count in step.
+        meta = u.get_feed_meta(rel_location)
+        for page in meta.get('pages', []):
+            if page['file'] == location:
+                page['items'] -= 1
+        u.write_feed_meta(rel_location, meta)
+    return True
 
 
 def _enum(**enums):
@@ -97,38 +325,25 @@ def cache_users(users):
     each one individually.
     """
     # Fetch the data from the user's feed.
-    import inspect
     from crawler.crawler import OnDemandCrawler
     remote_links = [user._feed_url for user in users]
     crawler = OnDemandCrawler()
-    user_dicts = crawler.get_user_info(remote_links)
-    # Set the data from the feed to the user's properties.
+    _set_profiles(users, crawler.get_user_info(remote_links))
+
+
+def _set_profiles(users, profiles):
+    """ Sets each user's properties from the profile of their feed.
+    profiles is a dict keyed by feed link. Users whose feed has no
+    profile are cached with no data. """
     for user in users:
-        for i, user_dict in enumerate(user_dicts):
-            user_methods = inspect.getmembers(User, predicate=inspect.ismethod)
-            user._status = DataLocations.CACHED
-            for key, value in user_dict.iteritems():
-                for name, method in user_methods:
-                    is_setter = name[0:3] == 'set'
-                    is_bound_to_key = False
-                    try:
-                        is_bound_to_key = method.binding == key
-                    except AttributeError as e:
-                        pass
-                    if is_setter and is_bound_to_key:
-                        method(user, value)
-                        break
-
-
-
-    # Local Users
-    #if len(local_users) > 0:
-    #    user_methods = inspect.getmembers(user, predicate=inspect.ismethod)
-    #    user_dict = { prop: getattr(self, prop) for prop in property_bindings }
-    #
-    #    for user in local_users:
-    #        user._status = DataLocations.CACHED
-    #        [setattr(user, key, value) for key, value in user_dict]
+        user._status = DataLocations.CACHED
+        profile = profiles.get(user._feed_url)
+        if profile is None:
+            continue
+        for key, value in profile.iteritems():
+            setter = SETTERS.get(key)
+            if setter is not None:
+                setter(user, value)
 
 
 class NoSuchUserError(Exception):
@@ -174,15 +389,7 @@ class User(object):
     """
 
     RESERVED = ('element',)
-    UB_ELEMENTS = {'status_id', 'username', 'user_id', 'profile', 'next_node',
-            'relocate', 'user_full_name', 'next_node', 'blocks', 'follows',
-            'message', 'reply', 'in_reply_to_status_id', 'in_reply_to_user_id',
-            'in_reply_to_user_link', 'reposted_status_id', 'reposted_status_pubdate',
-            'reposted_status_user_id', 'reposted_status_user_link', 'portrait',
-            'header'}
-    NSMAP = {
-            'microblog': 'http://openmicroblog.com/',
-        }
+    NSMAP = NSMAP
 
     def __init__(self, local_url=None, remote_url=None, entries=None, force_cache=False):
         if isinstance(entries, dict):
@@ -224,8 +431,7 @@ class User(object):
         User._generate_new_follows_list(follows_location)
 
         user = User(local_url=feed_location)
-        user.user_id = user_id
-        user.username = username
+        user.update(user_id=user_id, username=username)
 
         return user, feed_location, blocks_location, follows_location
 
@@ -289,7 +495,7 @@ class User(object):
 
     ############# Behind the Curtain ################
 
-    def _get_attr(self, attr, xpath):
+    def _get_attr(self, attr):
         """ Fetches the given attr based on the user's status.
 
         If a user is remote, then the user will first be fully
@@ -297,37 +503,87 @@ class User(object):
         the user's cached values will be used (unless cleared).
         """
         if self._status == DataLocations.LOCAL:
-            if attr in User.UB_ELEMENTS:
-                xpath = xpath.replace(attr, 'microblog:{attr}'.format(attr=attr))
-            return self._get_attr_el(self._rel_location, attr, xpath)[0].text
+            profile = getattr(self, '_profile', None)
+            if profile is not None:
+                return profile.get(attr)
+            return self._get_attr_el(self._rel_location, FEED[attr])[0].text
         elif self._status == DataLocations.REMOTE:
             self.cache_user()
         return self.__dict__.get(attr)
 
-    def _set_attr(self, attr, xpath, value):
+    def _set_attr(self, attr, value):
         """ Sets the given attr to the value. If the user is NOT a
         local user, then that user's cached values are updated.
         """
         if self._status == DataLocations.LOCAL:
-            if attr in User.UB_ELEMENTS:
-                xpath = xpath.replace(attr, 'microblog:{attr}'.format(
-                    ns=User.NSMAP.get('microblog'), attr=attr)),
-            _set_to_feed(self._rel_location, xpath, value)
+            batch_tree = getattr(self, '_batch_tree', None)
+            if batch_tree is not None:
+                _set_to_tree(batch_tree, FEED[attr], value)
+            else:
+                _set_to_feed(self._rel_location, FEED[attr], value)
+            profile = getattr(self, '_profile', None)
+            if profile is not None:
+                profile[attr] = value
         elif self._status == DataLocations.REMOTE:
             raise RemoteUserPropertyError
         else:
             self.__dict__[attr] = value
 
-    def _get_attr_el(self, location, attr, xpath):
+    def _get_attr_el(self, location, query):
         """ A more generic form of _get_attr that returns a
-        list of all elements matching the given xpath.
+        list of all elements the query finds in the feed at location.
         """
         if self._status != DataLocations.LOCAL:
             raise UserNotBackedError(\
                     'To get the elements of a feed, the user must be local.')
-        return u.get_user_feed(location).xpath(xpath, namespaces=User.NSMAP)
+        return query(u.get_user_feed(location, read_only=True))
 
 
+    @contextmanager
+    def batch(self):
+        """ Collects property changes made inside the with block and
+        writes them to a LOCAL user's feed once, when the block exits.
+        Nothing is written if the block raises. For CACHED users this
+        changes nothing, since their properties live in memory.
+
+            with user.batch():
+                user.link = link
+                user.language = 'en'
+        """
+        if self._status != DataLocations.LOCAL \
+                or getattr(self, '_batch_tree', None) is not None:
+            yield self
+            return
+        self._batch_tree = u.get_user_feed(self._rel_location)
+        try:
+            yield self
+            u.write_user_feed(self._batch_tree, self._rel_location)
+        finally:
+            self._batch_tree = None
+
+    def update(self, **fields):
+        """ Sets each of the given properties with a single write.
+        i.e. user.update(link=link, language='en') """
+        for name in fields:
+            if not isinstance(getattr(User, name, None), property):
+                raise AttributeError('User has no property {}.'.format(name))
+        with self.batch():
+            for name, value in fields.iteritems():
+                setattr(self, name, value)
+
+    def load_profile(self):
+        """ Reads every channel-level element of a LOCAL user's feed in
+        one pass over the feed's header. Until the snapshot is dropped
+        (see drop_profile), property reads are served from it instead
+        of the feed. Returns the user. """
+        if self._status == DataLocations.LOCAL:
+            self._profile = u.get_user_feed_header(self._rel_location)
+        return self
+
+    def drop_profile(self):
+        """ Drops the snapshot taken by load_profile. """
+        self._profile = None
+
     ################# Caching ###################
 
     def cache_user(self):
@@ -358,13 +614,11 @@ class User(object):
     # Username
 
     def get_username(self):
-        return self._get_attr(self.get_username.binding,
-                '//channel/username')
+        return self._get_attr(self.get_username.binding)
     get_username.binding = 'username'
 
     def set_username(self, username):
-        self._set_attr(self.set_username.binding,
-                '//channel/username', username)
+        self._set_attr(self.set_username.binding, username)
     set_username.binding = 'username'
 
     username = property(get_username, set_username)
@@ -372,13 +626,11 @@ class User(object):
     # Description
 
     def get_description(self):
-        return self._get_attr(self.get_description.binding,
-                '//channel/description')
+        return self._get_attr(self.get_description.binding)
     get_description.binding = 'description'
 
     def set_description(self, description):
-        self._set_attr(self.set_description.binding,
-                '//channel/description', description)
+        self._set_attr(self.set_description.binding, description)
     set_description.binding = 'description'
 
     description = property(get_description, set_description)
@@ -386,13 +638,11 @@ class User(object):
     # User_id
 
     def get_user_id(self):
-        return self._get_attr(self.get_user_id.binding,
-                '//channel/user_id')
+        return self._get_attr(self.get_user_id.binding)
     get_user_id.binding = 'user_id'
 
     def set_user_id(self, user_id):
-        self._set_attr(self.get_user_id.binding,
-                '//channel/user_id', user_id)
+        self._set_attr(self.set_user_id.binding, user_id)
     set_user_id.binding = 'user_id'
 
     user_id = property(get_user_id, set_user_id)
@@ -400,13 +650,11 @@ class User(object):
     # Full Name
 
     def get_full_name(self):
-        return self._get_attr(self.get_full_name.binding,
-                '//channel/user_full_name')
+        return self._get_attr(self.get_full_name.binding)
     get_full_name.binding = 'user_full_name'
 
     def set_full_name(self, full_name):
-        self._set_attr(self.set_full_name.binding,
-                '//channel/user_full_name', full_name)
+        self._set_attr(self.set_full_name.binding, full_name)
     set_full_name.binding = 'user_full_name'
 
     full_name = property(get_full_name, set_full_name)
@@ -414,13 +662,11 @@ class User(object):
     # Profile
 
     def get_profile(self):
-        return self._get_attr(self.get_profile.binding,
-                '//channel/profile')
+        return self._get_attr(self.get_profile.binding)
     get_profile.binding = 'profile'
 
     def set_profile(self, profile):
-        self._set_attr(self.set_profile.binding,
-                '//channel/profile', profile)
+        self._set_attr(self.set_profile.binding, profile)
     set_profile.binding = 'profile'
 
     profile = property(get_profile, set_profile)
@@ -428,13 +674,11 @@ class User(object):
     # Link
 
     def get_link(self):
-        return self._get_attr(self.get_link.binding,
-                '//channel/link')
+        return self._get_attr(self.get_link.binding)
     get_link.binding = 'link'
 
     def set_link(self, link):
-        self._set_attr(self.set_link.binding,
-                '//channel/link', link)
+        self._set_attr(self.set_link.binding, link)
     set_link.binding = 'link'
 
     link = property(get_link, set_link)
@@ -442,13 +686,11 @@ class User(object):
     # Portrait
 
     def get_portrait(self):
-        return self._get_attr(self.get_portrait.binding,
-                '//channel/portrait')
+        return self._get_attr(self.get_portrait.binding)
     get_portrait.binding = 'portrait'
 
     def set_portrait(self, portrait):
-        self._set_attr(self.set_portrait.binding,
-                '//channel/portrait', portrait)
+        self._set_attr(self.set_portrait.binding, portrait)
     set_portrait.binding = 'portrait'
 
     portrait = property(get_portrait, set_portrait)
@@ -456,13 +698,11 @@ class User(object):
     # Header
 
     def get_header(self):
-        return self._get_attr(self.get_header.binding,
-                '//channel/header')
+        return self._get_attr(self.get_header.binding)
     get_header.binding = 'header'
 
     def set_header(self, header):
-        self._set_attr(self.set_header.binding,
-                '//channel/header', header)
+        self._set_attr(self.set_header.binding, header)
     set_header.binding = 'header'
 
     header = property(get_header, set_header)
@@ -470,13 +710,11 @@ class User(object):
     # Language
 
     def get_language(self):
-        return self._get_attr(self.get_language.binding,
-                '//channel/language')
+        return self._get_attr(self.get_language.binding)
     get_language.binding = 'language'
 
     def set_language(self, language):
-        self._set_attr(self.set_language.binding,
-                '//channel/language', language)
+        self._set_attr(self.set_language.binding, language)
     set_language.binding = 'language'
 
     language = property(get_language, set_language)
@@ -484,42 +722,52 @@ class User(object):
     # Follows
 
     def get_follows(self):
-        """ Get the list of the people the user follows. """
+        """ Get the list of the people the user follows.
+
+        For LOCAL users the list is read from the follows file, and each
+        user is filled in from the profiles the crawler has cached, so no
+        feeds are fetched. Users whose feeds haven't been crawled lately
+        (see CacheManager.max_profile_age) only carry the id, name and
+        link from the follows file.
+        """
         follows = []
         if self._status == DataLocations.CACHED:
             follows = self.__dict__.get('follows')
-        else:
-            # Get the users from the feed.
-            # TODO: Only works for local users.
-            items = []
-            if self._status == DataLocations.LOCAL:
-                location = SettingsManager.get_user(self.user_id)['follows_location']
-                item_els = self._get_attr_el(location, self.get_follows.binding, '//channel/item')
-                follows = [_recursive_dict(item)[1] for item in item_els]
-
-            follows = [User(remote_url=item['user_link']) for item in follows]
-            cache_users(follows)
+        elif self._status == DataLocations.LOCAL:
+            entries = self.follows_entries
+            profiles = CacheManager.get_profiles([entry['user_link'] for entry in entries])
+            follows = [_listed_user(entry, profiles.get(entry['user_link']))
+                    for entry in entries]
         return follows
     get_follows.binding = 'follows_items'
 
     follows = property(get_follows)
 
+    @property
+    def follows_entries(self):
+        """ The entries of a LOCAL user's follows list, as dicts of
+        user_id, user_name and user_link, read from the follows file. """
+        if self._status != DataLocations.LOCAL:
+            raise RemoteUserPropertyError('Only local users have a follows file.')
+        location = SettingsManager.get_user(self.user_id)['follows_location']
+        return _read_user_list(location)
+
     @property
     def follows_just_links(self):
         """ Gets the list of links to the feeds the user follows.
         Basically a simplified version of get_user_follows. """
+        if self._status == DataLocations.LOCAL:
+            return [entry['user_link'] for entry in self.follows_entries]
         return [user.link for user in self.follows]
 
     # Follows Url
 
     def get_follows_url(self):
-        return self._get_attr(self.get_follows_url.binding,
-                '//channel/follows')
+        return self._get_attr(self.get_follows_url.binding)
     get_follows_url.binding = 'follows'
 
     def set_follows_url(self, url):
-        self._set_attr(self.set_follows_url.binding,
-                '//channel/follows', url)
+        self._set_attr(self.set_follows_url.binding, url)
     set_follows_url.binding = 'follows'
 
     follows_url = property(get_follows_url, set_follows_url)
@@ -533,8 +781,8 @@ class User(object):
         blocks = []
         if self._status == DataLocations.LOCAL:
             location = SettingsManager.get_user(self.user_id)['blocks_location']
-            feed = u.get_user_feed(location)
-            blocks_el = feed.xpath('//channel/item')
+            feed = u.get_user_feed(location, read_only=True)
+            blocks_el = ITEMS(feed)
             for user_el in blocks_el:
                 user_dict = _recursive_dict(user_el)[1]
                 blocks.append(User(**user_dict))
@@ -554,13 +802,11 @@ class User(object):
     # Blocks Url
 
     def get_blocks_url(self):
-        return self._get_attr(self.get_blocks_url.binding,
-                '//channel/blocks')
+        return self._get_attr(self.get_blocks_url.binding)
     get_blocks_url.binding = 'blocks'
 
     def set_blocks_url(self, url):
-        self._set_attr(self.set_blocks_url.binding,
-                '//channel/blocks', url)
+        self._set_attr(self.set_blocks_url.binding, url)
     set_blocks_url.binding = 'blocks'
 
     blocks_url = property(get_blocks_url, set_blocks_url)
@@ -568,27 +814,23 @@ class User(object):
     # Message
 
     def get_message_url(self):
-        return self._get_attr(self.get_docs_url.binding,
-                '//channel/message')
+        return self._get_attr(self.get_message_url.binding)
     get_message_url.binding = 'message'
 
     def set_message_url(self, url):
-        self._set_attr(self.set_mesage_url.binding,
-                '//channel/message', url)
+        self._set_attr(self.set_message_url.binding, url)
     set_message_url.binding = 'message'
 
-    messageurl = property(get_message_url, set_message_url)
+    message_url = messageurl = property(get_message_url, set_message_url)
 
     # Docs
 
     def get_docs_url(self):
-        return self._get_attr(self.get_docs_url.binding,
-                '//channel/docs')
+        return self._get_attr(self.get_docs_url.binding)
     get_docs_url.binding = 'docs'
 
     def set_docs_url(self, url):
-        self._set_attr(self.get_docs_url.binding,
-                '//channel/docs', url)
+        self._set_attr(self.set_docs_url.binding, url)
     set_docs_url.binding = 'docs'
 
     docs_url = property(get_docs_url, set_docs_url)
@@ -596,13 +838,11 @@ class User(object):
     # Next Node
 
     def get_next_node(self):
-        return self._get_attr(self.get_next_node.binding,
-                '//channel/next_node')
+        return self._get_attr(self.get_next_node.binding)
     get_next_node.binding = 'next_node'
 
     def set_next_node(self, next_node):
-        self._set_attr(self.set_next_node.binding,
-                '//channel/next_node', next_node)
+        self._set_attr(self.set_next_node.binding, next_node)
     set_next_node.binding = 'next_node'
 
     next_node = property(get_next_node, set_next_node)
@@ -610,13 +850,11 @@ class User(object):
     # Last Build Date
 
     def get_last_build_date(self):
-        return self._get_attr(get_last_build_date.binding,
-                '//channel/lastBuildDate')
+        return self._get_attr(self.get_last_build_date.binding)
     get_last_build_date.binding = 'lastBuildDate'
 
     def set_last_build_date(self, last_build_date):
-        self._set_attr(self.set_last_build_date.binding,
-                '//channel/lastBuildDate', last_build_date)
+        self._set_attr(self.set_last_build_date.binding, last_build_date)
     set_last_build_date.binding = 'lastBuildDate'
 
     last_build_date = property(get_last_build_date, set_last_build_date)
@@ -627,13 +865,11 @@ class User(object):
     # This is because the element should only exist if the relocate is filled.
 
     def get_relocate_url(self):
-        return self._get_attr(self.get_relocate_url.binding,
-                '//channel/relocate')
+        return self._get_attr(self.get_relocate_url.binding)
     get_relocate_url.binding = 'relocate'
 
     def set_relocate_url(self, url):
-        self._set_attr(self.set_last_build_date.binding,
-                '//channel/relocate', url)
+        self._set_attr(self.set_relocate_url.binding, url)
     set_relocate_url.binding = 'relocate'
 
     relocate = property(get_relocate_url, set_relocate_url)
@@ -647,25 +883,38 @@ class User(object):
         """ Adds the given post to the user's feed. """
         if self._status != DataLocations.LOCAL:
             raise RemoteUserPropertyError('Cannot add posts to non-local user.')
-        tree = u.get_user_feed(self._rel_location)
-        channel = tree.xpath('//channel')[0]
-        channel.append(new_post.to_element())
-        _write_to_feed(tree, self._rel_location)
+        # If the post would overflow the feed, archive the feed first, so
+        # the post starts the new page and readers of the feed see it.
+        element = new_post.to_element()
+        if _is_full(u.get_feed_meta(self._rel_location), 1,
+                len(etree.tostring(element, pretty_print=True))):
+            _paginate(self._rel_location)
+        # Append the post without rewriting the feed. The feed is only
+        # parsed when it has outgrown its page.
+        meta = u.append_user_feed_item(self._rel_location, element)
+        _feed_index(self._rel_location).add(new_post.guid, self._rel_location,
+                meta['items'] - 1)
 
     def delete_post(self, status_id):
-        """ Deletes the post with the given id from the feed.  """
-        # TODO: Test
+        """ Deletes the post with the given id from the feed, or from
+        the archive page that holds it. Returns True if the post was
+        found. """
         if self._status != DataLocations.LOCAL:
             raise RemoteUserPropertyError('Cannot delete posts from non-local user.')
-        to_delete_qry = '/channel/items/item[@guid={0}'.format(status_id)
-
-        feed_url, guid = _search_recurs(self._rel_location, to_delete_qry)
-
-        tree = u.get_user_feed(feed_url)
-        item = tree.xpath('//item[@guid=$guid]', guid)
-        item.getparent().remove(bad)
+        return _remove_item(self._rel_location, status_id)
 
-        u.write_user_feed(tree, self._rel_location)
+    def get_status(self, status_id):
+        """ Returns the post with the given id, or None if the user has
+        no such post. """
+        if self._status == DataLocations.LOCAL:
+            found = _find_item(self._rel_location, status_id, read_only=True)
+            if found is not None:
+                return Status(_recursive_dict(found[2])[1], user=self)
+        else:
+            stati = [status for status in self.user_timeline(n=None)
+                    if status.guid == status_id]
+            if stati:
+                return stati[0]
 
     # Following
 
@@ -688,7 +937,7 @@ class User(object):
             raise RemoteUserPropertyError('Cannot add follows to non-local user.')
         location = SettingsManager.get_user(self.user_id)['follows_location']
         feed = u.get_user_feed(location)
-        tree = feed.xpath('//channel')[0]
+        tree = CHANNEL(feed)[0]
         element = E.item(
                 E.user_id(user.user_id),
                 E.user_name(user.username),
@@ -698,16 +947,14 @@ class User(object):
         _write_to_feed(feed, location)
 
     def unfollow(self, user_id, user_link, user_name):
-        """ Deletes a user from the user's follow list. All 3 parameters
-        are needed since the user_id and user_name may not be unique. """
+        """ Deletes a user from the user's follow list. The entry is found
+        by its user_link, since the user_id and user_name may not be
+        unique. """
         # TODO: Test
         if self._status != DataLocations.LOCAL:
             raise RemoteUserPropertyError('Cannot add follows to non-local user.')
-        to_delete_qry = '/channel/item[user_name=\'{0}\' and user_id=\'{1}\']'\
-                .format(user_name, user_id)
         location = SettingsManager.get_user(self.user_id)['follows_location']
-        feed_url, guid = _search_recurs(location, to_delete_qry)
-        _del_from_feed(feed_url, to_delete_qry)
+        _remove_item(location, user_link)
 
     # Blocking
 
@@ -727,79 +974,142 @@ class User(object):
             raise RemoteUserPropertyError('Cannot add follows to non-local user.')
         location = SettingsManager.get_user(self.user_id)['blocks_location']
         feed = u.get_user_feed(location)
-        tree = feed.xpath('//channel')[0]
+        tree = CHANNEL(feed)[0]
         element = E.item(
                 E.user_id(user.user_id),
                 E.user_name(user.username),
                 E.user_link(user.link)
                 )
         tree.append(element)
-        _write_to_feed(feed, 'user/blocks.xml')
+        _write_to_feed(feed, location)
 
     def unblock(self, user_id, user_link, user_name):
-        """ Deletes a user from the user's follow list. All 3 parameters
-        are needed since the user_id and user_name may not be unique. """
+        """ Deletes a user from the user's block list. The entry is found
+        by its user_link, since the user_id and user_name may not be
+        unique. """
         # TODO: Test
         if self._status != DataLocations.LOCAL:
             raise RemoteUserPropertyError('Cannot add blocks to non-local user.')
         location = SettingsManager.get_user(self.user_id)['blocks_location']
-        to_delete_qry = '/channel/items/item[@user_name={0} and @user_id={1} \
-                and @user_link={2}]'.format(user_name, user_id, user_link)
-
-        feed_url, guid = _search_recurs(location, to_delete_qry)
-        _del_from_feed(feed_url, to_delete_qry)
+        _remove_item(location, user_link)
 
 
     # Timeline Methods
 
-    def user_timeline(self, start=None, n=25):
+    def user_timeline(self, start=None, n=25, since=None, until=None):
         """ Fetch the user's timeline.
 
         Starting at the starting post id, fetches n posts (assuming the posts are ordered).
         Positive n for posts since start, negative n for previous posts.
-        Zero (or nothing) for only the post with the given id. """
-        # TODO: Optimize this.
+        Zero (or nothing) for only the post with the given id. None for
+        every post.
+
+        since and until (datetimes or UTC epochs) limit the timeline to
+        the posts published between them. For local users only the archive
+        pages whose pubdates overlap that range are read, and pages stop
+        being read once n posts are found. Pages are also only read until
+        the start post is found.
+        """
+        since, until = _as_epoch(since), _as_epoch(until)
         stati = []
-        if self._status == DataLocations.LOCAL:
-            location = SettingsManager.get_user(self.user_id)['feed_location']
-            tree = u.get_user_feed(location)
-            status_elements = tree.xpath('//channel/item')
-            status_dicts = [_recursive_dict(status_el)[1] for status_el in
-                   status_elements]
-            stati = [Status(status_dict, user=self) for status_dict in status_dicts]
+        if self._status == DataLocations.LOCAL and start is not None:
+            return self._timeline_from(start, n, since, until)
+        elif self._status == DataLocations.LOCAL:
+            limit = None
+            if start is None and n is not None and n >= 0:
+                limit = n or 1
+            stati = list(self.iter_timeline(limit, since, until))
         elif self._status == DataLocations.REMOTE:
             from crawler.crawler import OnDemandCrawler
             crawler = OnDemandCrawler()
             items = crawler.get_all_items([self._feed_url])[self._feed_url]
             stati = [Status(item_dict) for item_dict in items]
+            stati = [status for status in stati
+                    if (since is None or status.pubdate_epoch >= since)
+                    and (until is None or status.pubdate_epoch <= until)]
+            stati.sort(key=lambda x: x.pubdate_epoch, reverse=True)
         else:
             # TODO: Figure out cached users.
             pass
 
-        stati.sort(key=lambda x: x.pubdate, reverse=True)
-        starting = None
         if start is not None:
             starting = stati.index([status for status in stati if status.guid == start][0])
             # Get only the single post.
             if n == 0:
-                return starting
+                return stati[starting]
             # Get n posts.
             if n < 0:
-                stati = reversed(stati)
-            end = starting + abs(n)
-            return stati[starting:ending]
+                stati = stati[::-1]
+                starting = len(stati) - 1 - starting
+            return stati[starting:starting + abs(n)]
         elif n == 0:
             return stati[0]
         else:
             return stati[:n]
 
-    def home_timeline(self, start=None, n=25):
+    def _timeline_from(self, start, n, since, until):
+        """ Returns the posts of a local timeline around the post with the
+        guid start, like user_timeline does. The timeline is streamed
+        until the start post (and, for positive n, the posts after it) is
+        found. Returns an empty list (None for n == 0) if there's no such
+        post. """
+        posts = self.iter_timeline(None, since, until)
+        if n is not None and n < 0:
+            # The start post and the posts newer than it, oldest first.
+            newer = deque(maxlen=abs(n))
+            for status in posts:
+                newer.append(status)
+                if status.guid == start:
+                    return list(reversed(newer))
+            return []
+        for status in posts:
+            if status.guid == start:
+                if n == 0:
+                    return status
+                return [status] + list(islice(posts, None if n is None else n - 1))
+        return None if n == 0 else []
+
+    def iter_timeline(self, n=None, since=None, until=None):
+        """ Yields the newest n posts (all of them if n is None) of a
+        local user's timeline, newest first, optionally limited to the
+        posts published between since and until (datetimes or UTC
+        epochs). Pages are read lazily and only the posts that are
+        yielded are kept. """
+        if self._status != DataLocations.LOCAL:
+            raise UserNotBackedError('Only local timelines can be streamed.')
+        for item in _timeline_items(self._rel_location,
+                _as_epoch(since), _as_epoch(until), n):
+            yield Status(item, user=self)
+
+    def home_timeline(self, start=None, n=25, live=False):
         """ Fetches the user's home timeline.
 
         This is a collection of posts from the people the user follows.
         They are ordered reverse chronologically.
+
+        Posts are read from the timeline cache that the crawler keeps up
+        to date, so no feeds are fetched. Pass the guid of the last post
+        on a page as start to get the page after it. If there is no cache
+        the timeline is empty, unless live is True: then every followed
+        feed is crawled while the caller waits.
+
+        The cache holds the posts of every feed the crawler reads, so
+        only the posts from the user's own feed and the feeds they
+        follow are returned.
         """
-        # TODO: Optimize this.
+        if live:
+            return self._crawl_home_timeline(n)
+        if CacheManager.timeline_store is None:
+            return []
+        links = self.follows_just_links + [self.link]
+        if start is None:
+            items = CacheManager.get_timeline_page(n, links=links)
+        else:
+            items = CacheManager.get_timeline_after(start, n, links=links)
+        return [Status(item, user=User(entries=item['user'])) for item in items]
+
+    def _crawl_home_timeline(self, n=25):
+        """ Builds the home timeline by crawling every followed feed. """
         follow_urls = self.follows_just_links
         follow_urls.append(self.link)
         from crawler.crawler import OnDemandCrawler
@@ -812,6 +1122,20 @@ class User(object):
         for status_dict in all_items:
             user = User(entries=status_dict['user'])
             timeline.append(Status(status_dict, user=user))
-        timeline.sort(key=lambda x: x.pubdate, reverse=True)
+        timeline.sort(key=lambda x: x.pubdate_epoch, reverse=True)
         return timeline[:n]
 
+
+def _setter_bindings(cls):
+    """ Returns a dict of the element each of the class's setters is
+    bound to, and the setter. """
+    setters = {}
+    for name, attr in vars(cls).iteritems():
+        binding = getattr(attr, 'binding', None)
+        if name.startswith('set') and binding is not None:
+            setters[binding] = attr
+    return setters
+
+
+# The setter for each feed element, used to fill in CACHED users.
+SETTERS = _setter_bindings(User)
@@ -0,0 +1,69 @@
+""" Precompiled XPath queries for Open Microblog feeds.
+
+Every element of a feed's channel and of its items has a query here,
+compiled once at import with the Open Microblog namespace map attached.
+Each query matches the element with or without the microblog: prefix,
+since feeds written by older versions (and plain RSS feeds) leave it
+off. i.e.
+
+    FEED['username'](tree)      # //channel/username in a feed tree
+    CHILD['guid'](item)         # the guid of an item element
+    CHILD['next_node'](channel) # the next_node of a channel element
+
+Queries return lists of elements, like etree.XPath. child_text() returns
+the text of a child instead.
+"""
+
+from lxml import etree
+
+
+MICROBLOG_NAMESPACE = 'microblog'
+NSMAP = {
+        MICROBLOG_NAMESPACE: 'http://openmicroblog.com/',
+    }
+
+CHANNEL_ELEMENTS = ('username', 'user_id', 'user_full_name', 'description',
+        'header', 'portrait', 'profile', 'link', 'blocks', 'follows', 'message',
+        'docs', 'language', 'lastBuildDate', 'next_node', 'relocate', 'item')
+
+ITEM_ELEMENTS = ('guid', 'pubdate', 'pubDate', 'description', 'language',
+        'reply', 'in_reply_to_user_id', 'in_reply_to_user_link',
+        'in_reply_to_status_id', 'reposted_status_user_id', 'reposted_user_link',
+        'reposted_status_id', 'reposted_status_pubdate', 'user_id', 'username',
+        'user_name', 'user_link')
+
+
+def _compile(path, name):
+    return etree.XPath('{0}/{1} | {0}/{2}:{1}'.format(path, name, MICROBLOG_NAMESPACE),
+            namespaces=NSMAP)
+
+
+class _Queries(dict):
+    """ Queries by element name. Elements that aren't listed above are
+    compiled the first time they are asked for. """
+
+    def __init__(self, path, names):
+        super(_Queries, self).__init__((name, _compile(path, name)) for name in names)
+        self.path = path
+
+    def __missing__(self, name):
+        query = self[name] = _compile(self.path, name)
+        return query
+
+
+# Channel elements, queried from the root of a feed tree.
+FEED = _Queries('//channel', CHANNEL_ELEMENTS)
+
+# Children of the given element (a channel or an item).
+CHILD = _Queries('.', CHANNEL_ELEMENTS + ITEM_ELEMENTS)
+
+CHANNEL = etree.XPath('//channel')
+ITEMS = etree.XPath('//channel/item')
+
+
+def child_text(element, name):
+    """ Returns the text of the element's first name child, or None if
+    it has none. """
+    children = CHILD[name](element)
+    if children:
+        return children[0].text
@@ -0,0 +1,102 @@
+""" Fast parsing for feed pubdates.
+
+Nearly every pubdate in an Open Microblog feed is an RFC-822 date in
+the shape written by model.status.DATE_STR_FORMAT
+(i.e. 'Thu, 12 Mar 2015 05:33:41 +0000'). parse_pubdate() handles those
+with a single regex match, and falls back to dateutil for anything
+else.
+
+Items are parsed once, when they are ingested, and carry the result as
+an integer UTC epoch under EPOCH_KEY. Everything that orders or filters
+items uses that key instead of parsing the pubdate again.
+"""
+
+import re
+import calendar
+from datetime import datetime
+
+from dateutil.parser import parse
+from dateutil.tz import tzutc, tzoffset
+
+
+_RFC822 = re.compile(r'''
+    ^\s*
+    (?:[A-Za-z]{3},?\s+)?                   # Weekday
+    (\d{1,2})\s+([A-Za-z]{3})\s+(\d{4})\s+  # Day Month Year
+    (\d{1,2}):(\d{2})(?::(\d{2}))?          # Time
+    \s*(?:([+-])(\d{2}):?(\d{2})|(GMT|UTC|UT|Z))?
+    \s*$''', re.VERBOSE | re.IGNORECASE)
+
+_MONTHS = { name.lower(): i for i, name in enumerate(calendar.month_abbr) if name }
+
+EPOCH_KEY = 'pubdate_epoch'
+
+_UTC = tzutc()
+_OFFSETS = {}
+
+
+def _tz(sign, hours, minutes):
+    """ Returns a (shared) tzinfo for the given offset. """
+    offset = int(hours) * 3600 + int(minutes) * 60
+    if sign == '-':
+        offset = -offset
+    if offset == 0:
+        return _UTC
+    tz = _OFFSETS.get(offset)
+    if tz is None:
+        tz = _OFFSETS[offset] = tzoffset(None, offset)
+    return tz
+
+
+def parse_rfc822(date_str):
+    """ Parses an RFC-822 date. Returns None if the string is not in
+    that shape. Dates without a zone are returned naive, like dateutil. """
+    m = _RFC822.match(date_str)
+    if m is None:
+        return None
+    day, month, year, hour, minute, second, sign, tz_hours, tz_minutes, tz_name = m.groups()
+    month = _MONTHS.get(month.lower())
+    if month is None:
+        return None
+    if sign is not None:
+        tz = _tz(sign, tz_hours, tz_minutes)
+    elif tz_name is not None:
+        tz = _UTC
+    else:
+        tz = None
+    try:
+        return datetime(int(year), month, int(day), int(hour), int(minute),
+                int(second or 0), tzinfo=tz)
+    except ValueError:
+        return None
+
+
+def parse_pubdate(date_str):
+    """ Parses a pubdate into a datetime. RFC-822 dates take the fast
+    path and everything else is handed to dateutil. """
+    dt = parse_rfc822(date_str)
+    if dt is None:
+        dt = parse(date_str)
+    return dt
+
+
+def to_epoch(pubdate):
+    """ Converts a pubdate (string or datetime) to an integer UTC epoch.
+    Naive datetimes are treated as UTC. """
+    if not isinstance(pubdate, datetime):
+        pubdate = parse_pubdate(pubdate)
+    return calendar.timegm(pubdate.utctimetuple())
+
+
+def from_epoch(epoch):
+    """ Converts a UTC epoch back to an aware datetime. """
+    return datetime.fromtimestamp(epoch, _UTC)
+
+
+def item_epoch(item):
+    """ Returns the item's pubdate as a UTC epoch. The pubdate is only
+    parsed the first time; the result is stored on the item. """
+    epoch = item.get(EPOCH_KEY)
+    if epoch is None:
+        epoch = item[EPOCH_KEY] = to_epoch(item['pubdate'])
+    return epoch
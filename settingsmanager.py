@@ -1,14 +1,39 @@
-""" Manages the CRUD of the app's settings. """
+""" Manages the CRUD of the app's settings.
 
+Settings are kept in the JSON settings file by default. A different
+backing store (i.e. settingsstore.SQLiteSettingsStore) can be plugged
+in with SettingsManager.use_store(); if a settings database exists at
+SettingsManager.settings_db_location it is used automatically.
 
-import os, json
-from util import to_settings, from_settings
+Either way, settings are read from a process-local snapshot that is only
+reloaded when the file (or database) changes. Registered users in a
+store are looked up through its indexed tables instead.
+"""
+
+
+import os, json, copy
+from util import to_settings, read_settings, file_signature
+from settingsstore import SQLiteSettingsStore, migrate_json_settings
 
 
 class SettingsManager():
 
     # Class Variables
     settings_file_location = os.path.expanduser('~/.microblogger_settings.json')
+    settings_db_location = os.path.expanduser('~/.microblogger_settings.db')
+
+    # The pluggable backing store. None means the JSON settings file.
+    store = None
+
+    # The process-local snapshot of the settings, and the signature
+    # (see _signature) of the file or store it was read from.
+    _snapshot = None
+    _snapshot_signature = None
+    # username -> user_id index over the snapshot's registered_users,
+    # dropped on every write and rebuilt on the next lookup.
+    _username_index = None
+    cache_hits = 0
+    cache_misses = 0
 
     # Init/Destroy
 
@@ -18,6 +43,7 @@ class SettingsManager():
         that location. """
 
         SettingsManager.settings_file_location = settings_file_location
+        SettingsManager.invalidate()
 
         # Create a settings file if one does not already exist.
         if settings_file_location is not None and \
@@ -34,6 +60,7 @@ class SettingsManager():
         data = {}
         with open(SettingsManager.settings_file_location, 'w') as f:
             f.write(json.dumps(data))
+        SettingsManager.invalidate()
 
     @staticmethod
     def destroy_settings():
@@ -47,25 +74,172 @@ class SettingsManager():
         # TODO
         pass
 
+    # Backing Stores
+
+    @staticmethod
+    def use_store(store):
+        """ Sends all settings and registry operations to the given store.
+        Passing None switches back to the JSON settings file. """
+        SettingsManager.store = store
+        SettingsManager.invalidate()
+
+    @staticmethod
+    def migrate_to_sqlite(db_location=None):
+        """ Copies the JSON settings into a SQLite store at db_location
+        (once) and switches over to it. Returns the store. """
+        if db_location is None:
+            db_location = SettingsManager.settings_db_location
+        SettingsManager.settings_db_location = db_location
+        store = migrate_json_settings(SettingsManager.settings_file_location, db_location)
+        SettingsManager.use_store(store)
+        return store
+
+    # Snapshot Caching
+
+    @staticmethod
+    def invalidate():
+        """ Drops the in-process settings snapshot. The next read will
+        reload the settings file. """
+        SettingsManager._snapshot = None
+        SettingsManager._snapshot_signature = None
+        SettingsManager._username_index = None
+
+    @staticmethod
+    def cache_stats():
+        """ Returns the number of reads served from the snapshot (hits)
+        and the number of times the settings were read from the file or
+        store (misses). """
+        return {
+                'hits': SettingsManager.cache_hits,
+                'misses': SettingsManager.cache_misses
+                }
+
+    @staticmethod
+    def reset_cache_stats():
+        """ Zeroes the hit/miss counters. """
+        SettingsManager.cache_hits = 0
+        SettingsManager.cache_misses = 0
+
+    @staticmethod
+    def _signature():
+        """ Returns the signature of the settings file, or of the store
+        if one is in use. It changes whenever the settings are written. """
+        if SettingsManager.store is not None:
+            return SettingsManager.store.signature()
+        return file_signature(SettingsManager.settings_file_location)
+
+    @staticmethod
+    def _settings():
+        """ Returns the settings dict, reloading it from disk only if
+        the settings file (or store) has changed since the snapshot was
+        taken. """
+        signature = SettingsManager._signature()
+        if signature is not None and signature == SettingsManager._snapshot_signature:
+            SettingsManager.cache_hits += 1
+            return SettingsManager._snapshot
+
+        SettingsManager.cache_misses += 1
+        if SettingsManager.store is not None:
+            SettingsManager._snapshot = SettingsManager.store.settings()
+        else:
+            SettingsManager._snapshot = read_settings(SettingsManager.settings_file_location)
+        SettingsManager._snapshot_signature = signature
+        SettingsManager._username_index = None
+        return SettingsManager._snapshot
+
+    @staticmethod
+    def _get(key):
+        """ Returns the value for the given key in the snapshot itself.
+        It must not be modified. """
+        settings = SettingsManager._settings()
+        if settings is not None:
+            return settings.get(key)
+
+    @staticmethod
+    def _usernames():
+        """ Returns the username -> user_id index, building it from
+        the current snapshot if needed. """
+        users = SettingsManager._get('registered_users') or {}
+        if SettingsManager._username_index is None:
+            SettingsManager._username_index = { user_dict['username']: user_id
+                    for user_id, user_dict in users.iteritems() }
+        return SettingsManager._username_index
+
+    # Settings Access
+
     @staticmethod
     def add(key, value):
-        """ Adds the given value to the settings file. """
-        return to_settings(SettingsManager.settings_file_location, key, value)
+        """ Adds the given value to the settings file (or store). If the
+        snapshot was current before the write and no other process wrote
+        in between, it is updated in place instead of being reloaded. """
+        store = SettingsManager.store
+        snapshot = SettingsManager._snapshot
+        SettingsManager._username_index = None
+        if store is not None:
+            version = store.data_version()
+            was_current = SettingsManager._signature() == SettingsManager._snapshot_signature
+            result = store.add(key, value)
+            signature = SettingsManager._signature()
+            # The store keeps registered users out of the snapshot.
+            only_ours = was_current and store.data_version() == version \
+                    and key != 'registered_users'
+        else:
+            result = None
+            read_signature, signature = to_settings(
+                    SettingsManager.settings_file_location, key, value) or (None, None)
+            only_ours = read_signature == SettingsManager._snapshot_signature
+        if snapshot is not None and signature is not None and only_ours:
+            snapshot[key] = value
+            SettingsManager._snapshot_signature = signature
+        else:
+            SettingsManager.invalidate()
+        return result
 
     @staticmethod
     def get(key):
-        """ Gets the value for the given key from the settings. """
-        return from_settings(SettingsManager.settings_file_location, key)
+        """ Gets the value for the given key from the settings. Dicts and
+        lists are copies, so changing them doesn't touch the snapshot;
+        write changes back with add(). """
+        if SettingsManager.store is not None and key == 'registered_users':
+            return SettingsManager.store.get(key)
+        return copy.deepcopy(SettingsManager._get(key))
 
     @staticmethod
     def get_user(user_id):
-        return SettingsManager.get('registered_users')[user_id]
+        """ Returns a copy of the user dict for the user_id. """
+        if SettingsManager.store is not None:
+            return SettingsManager.store.get_user(user_id)
+        return copy.deepcopy(SettingsManager._get('registered_users')[user_id])
+
+    @staticmethod
+    def user_count():
+        """ Returns the number of registered users. """
+        if SettingsManager.store is not None:
+            return SettingsManager.store.user_count()
+        return len(SettingsManager._get('registered_users') or {})
+
+    @staticmethod
+    def get_user_id_for_username(username):
+        """ Returns the user_id registered to the given username or
+        None if no such user exists. """
+        if SettingsManager.store is not None:
+            return SettingsManager.store.get_user_id_for_username(username)
+        return SettingsManager._usernames().get(username)
+
+    @staticmethod
+    def get_user_by_username(username):
+        """ Returns the registered user dict for the given username or
+        None if no such user exists. """
+        user_id = SettingsManager.get_user_id_for_username(username)
+        if user_id is not None:
+            return SettingsManager.get_user(user_id)
 
     @staticmethod
     def add_user(username, pwd_hash, user_id, feed_location, blocks_location, follows_location):
-        users = SettingsManager.get('registered_users')
-        if users is None:
-            users = {}
+        if SettingsManager.store is not None:
+            return SettingsManager.store.add_user(username, pwd_hash, user_id,
+                    feed_location, blocks_location, follows_location)
+        users = SettingsManager.get('registered_users') or {}
         users[user_id] = {
                 'pwd_hash': pwd_hash,
                 'username': username,
@@ -76,5 +250,6 @@ class SettingsManager():
         SettingsManager.add('registered_users', users)
 
 
-
-
+# Use the settings database if one has been set up.
+if os.path.isfile(SettingsManager.settings_db_location):
+    SettingsManager.use_store(SQLiteSettingsStore(SettingsManager.settings_db_location))
@@ -0,0 +1,176 @@
+""" A SQLite backing store for the app's settings and user registry.
+
+The settings file written by config.py keeps every setting, including
+the whole registered_users dict, in one JSON document that has to be
+rewritten for every change. This store keeps settings as individual
+rows and registered users in their own table (indexed by username),
+so each change is a single row write. The database is opened in WAL
+mode, so the WSGI processes and the crawler can read while another
+process writes.
+
+Plug it into the SettingsManager with SettingsManager.use_store().
+"""
+
+import os
+import json
+
+from sqlitestore import SQLiteStore
+from util import file_signature
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS registered_users (
+    user_id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    pwd_hash TEXT,
+    feed_location TEXT,
+    blocks_location TEXT,
+    follows_location TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS registered_users_username
+    ON registered_users (username);
+'''
+
+USER_COLUMNS = ('user_id', 'username', 'pwd_hash', 'feed_location',
+        'blocks_location', 'follows_location')
+
+# Marks a database that has already been filled from a JSON settings file.
+MIGRATED_KEY = '_migrated_from'
+
+
+class SQLiteSettingsStore(SQLiteStore):
+    """ Stores settings and registered users in a SQLite database. """
+
+    SCHEMA = SCHEMA
+
+    def signature(self):
+        """ Returns a tuple that changes whenever the database is written
+        to: the (mtime, size, inode) of the database file and of its
+        write-ahead log, which every commit appends to. """
+        return file_signature(self.location), file_signature(self.location + '-wal')
+
+    def data_version(self):
+        """ Returns a number that changes whenever another connection
+        commits to the database (but not when this thread's does). """
+        return self._connection().execute('PRAGMA data_version').fetchone()[0]
+
+    # Settings
+
+    def settings(self):
+        """ Returns every setting but the user registry as a dict. """
+        rows = self._connection().execute('SELECT key, value FROM settings')
+        return { key: json.loads(value) for key, value in rows }
+
+    def get(self, key):
+        """ Gets the value for the given key. registered_users is built
+        from the user table for compatibility with the JSON layout. """
+        if key == 'registered_users':
+            return self.all_users()
+        row = self._connection().execute(
+                'SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+
+    def add(self, key, value):
+        """ Sets the value for the given key. """
+        if key == 'registered_users':
+            return self.add_users(value)
+        conn = self._connection()
+        with conn:
+            _insert_setting(conn, key, value)
+
+    # Registered Users
+
+    def _user_dict(self, row):
+        user_dict = dict(zip(USER_COLUMNS, row))
+        del user_dict['user_id']
+        return user_dict
+
+    def get_user(self, user_id):
+        """ Returns the user dict for the user_id. Raises KeyError if
+        no such user is registered. """
+        row = self._connection().execute(
+                'SELECT {} FROM registered_users WHERE user_id = ?'\
+                        .format(', '.join(USER_COLUMNS)), (user_id,)).fetchone()
+        if row is None:
+            raise KeyError(user_id)
+        return self._user_dict(row)
+
+    def get_user_id_for_username(self, username):
+        """ Returns the user_id for the given username, or None. """
+        row = self._connection().execute(
+                'SELECT user_id FROM registered_users WHERE username = ?',
+                (username,)).fetchone()
+        if row is not None:
+            return row[0]
+
+    def all_users(self):
+        """ Returns every registered user as a dict of user_id -> user dict. """
+        rows = self._connection().execute(
+                'SELECT {} FROM registered_users'.format(', '.join(USER_COLUMNS)))
+        return { row[0]: self._user_dict(row) for row in rows }
+
+    def user_count(self):
+        return self._connection().execute(
+                'SELECT COUNT(*) FROM registered_users').fetchone()[0]
+
+    def add_user(self, username, pwd_hash, user_id, feed_location, blocks_location,
+            follows_location):
+        """ Adds or replaces a registered user. """
+        conn = self._connection()
+        with conn:
+            _insert_user(conn, user_id, {
+                'username': username,
+                'pwd_hash': pwd_hash,
+                'feed_location': feed_location,
+                'blocks_location': blocks_location,
+                'follows_location': follows_location
+                })
+
+    def add_users(self, users):
+        """ Adds every user in the given user_id -> user dict mapping
+        in one transaction. """
+        conn = self._connection()
+        with conn:
+            for user_id, user_dict in users.iteritems():
+                _insert_user(conn, user_id, user_dict)
+
+
+def _insert_user(conn, user_id, user_dict):
+    conn.execute('INSERT OR REPLACE INTO registered_users ({}) VALUES (?, ?, ?, ?, ?, ?)'\
+            .format(', '.join(USER_COLUMNS)),
+            (user_id,) + tuple(user_dict.get(column) for column in USER_COLUMNS[1:]))
+
+
+def _insert_setting(conn, key, value):
+    conn.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
+            (key, json.dumps(value)))
+
+
+def migrate_json_settings(json_location, db_location):
+    """ Copies the settings and registered users from the JSON settings
+    file at json_location into a new SQLite store at db_location.
+    The migration only happens once; later calls return the existing store
+    untouched. Returns the store. """
+    store = SQLiteSettingsStore(db_location)
+    if store.get(MIGRATED_KEY) is not None or not os.path.isfile(json_location):
+        return store
+
+    with open(json_location, 'r') as f:
+        settings_data = json.loads(f.read())
+
+    # Everything goes in one transaction so a failed migration can be rerun.
+    conn = store._connection()
+    with conn:
+        for key, value in settings_data.iteritems():
+            if key == 'registered_users':
+                for user_id, user_dict in (value or {}).iteritems():
+                    _insert_user(conn, user_id, user_dict)
+            else:
+                _insert_setting(conn, key, value)
+        _insert_setting(conn, MIGRATED_KEY, json_location)
+    return store
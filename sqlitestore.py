@@ -0,0 +1,33 @@
+""" The base of the app's SQLite backed stores.
+
+Each store opens its database in WAL mode, so the WSGI processes and the
+crawler can read while another process writes, and keeps one connection
+per thread, since sqlite3 connections can't be shared across threads.
+"""
+
+import sqlite3
+import threading
+
+
+class SQLiteStore(object):
+    """ A SQLite database with a per thread connection. Subclasses set
+    SCHEMA to the script that creates their tables. """
+
+    SCHEMA = ''
+
+    def __init__(self, location):
+        self.location = location
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        with conn:
+            conn.executescript(self.SCHEMA)
+
+    def _connection(self):
+        """ Returns this thread's connection to the database. """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.location, timeout=30)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
@@ -4,13 +4,25 @@ import os
 import sys
 
 from crawler.crawler import MicroblogFeedCrawler
-from feed import feedreader as fr
+from model.user import User
 from settingsmanager import SettingsManager
 
 
 PID_LOCATION = '/tmp/microblog/pid'
 
 
+def crawl_links():
+    """ Returns the feeds to crawl: every registered user's own feed,
+    and the feeds they follow. Only the local follows files are read. """
+    links = set()
+    users = SettingsManager.get('registered_users') or {}
+    for user_dict in users.itervalues():
+        user = User(local_url=user_dict['feed_location'])
+        links.update(user.follows_just_links)
+        links.add(user.link)
+    return sorted(links)
+
+
 def main():
     # Check the user's pid file to see if
     # a crawler already exists.
@@ -19,8 +31,7 @@ def main():
             f.write('working')
 
         print 'Starting...'
-        links = fr.get_user_follows_links()
-        links.append(fr.get_user_link())
+        links = crawl_links()
         print links
         MicroblogFeedCrawler(links,
                 cache_location=SettingsManager.get('cache_location'),
@@ -0,0 +1,240 @@
+""" Tests for the CacheManager. """
+
+import unittest
+import sys
+import os
+import json
+import shutil
+import sqlite3
+import tempfile
+
+sys.path.insert(0, '../')
+from cachemanager import CacheManager
+import timelinestore
+from timelinestore import SQLiteTimelineStore
+
+
+def _status(guid, pubdate, link='http://example.com/feed.xml'):
+    return {
+            'guid': guid,
+            'pubdate': pubdate,
+            'description': 'Status {}'.format(guid),
+            'user': { 'link': link }
+            }
+
+
+class CacheManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        CacheManager(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_add_to_timeline_orders_by_pubdate(self):
+        CacheManager.add_to_timeline(_status('b', 'Thu, 07 May 2015 12:02:30 +0000'))
+        CacheManager.add_to_timeline(_status('c', 'Fri, 08 May 2015 12:02:30 +0000'))
+        CacheManager.add_to_timeline(_status('a', 'Wed, 06 May 2015 12:02:30 +0000'))
+        guids = [status['guid'] for status in CacheManager.get_timeline()]
+        self.assertEqual(guids, ['c', 'b', 'a'])
+
+    def test_timeline_is_bounded(self):
+        CacheManager.timeline_store.max_items = 3
+        for day in range(1, 6):
+            CacheManager.add_to_timeline(_status(str(day),
+                '{:02d} May 2015 12:00:00 +0000'.format(day)))
+        guids = [status['guid'] for status in CacheManager.get_timeline()]
+        self.assertEqual(guids, ['5', '4', '3'])
+
+    def test_remove_from_timeline(self):
+        CacheManager.add_to_timeline(_status('a', 'Wed, 06 May 2015 12:02:30 +0000'))
+        CacheManager.add_to_timeline(_status('b', 'Thu, 07 May 2015 12:02:30 +0000'))
+        CacheManager.remove_from_timeline('b')
+        guids = [status['guid'] for status in CacheManager.get_timeline()]
+        self.assertEqual(guids, ['a'])
+
+    def test_get_timeline_from_start_id(self):
+        for day in range(1, 6):
+            CacheManager.add_to_timeline(_status(str(day),
+                '{:02d} May 2015 12:00:00 +0000'.format(day)))
+        self.assertEqual([s['guid'] for s in CacheManager.get_timeline('4', 2)], ['4', '3'])
+        self.assertEqual([s['guid'] for s in CacheManager.get_timeline('4', 0)], ['4'])
+
+    def test_add_many_to_timeline(self):
+        CacheManager.add_many_to_timeline([
+            _status('b', 'Thu, 07 May 2015 12:02:30 +0000'),
+            _status('c', 'Fri, 08 May 2015 12:02:30 +0000'),
+            _status('a', 'Wed, 06 May 2015 12:02:30 +0000')])
+        guids = [status['guid'] for status in CacheManager.get_timeline()]
+        self.assertEqual(guids, ['c', 'b', 'a'])
+
+    def test_timeline_writer_flushes_on_size(self):
+        writer = CacheManager.timeline_writer(max_items=2, max_seconds=60)
+        for day in range(1, 6):
+            writer.add(_status(str(day), '{:02d} May 2015 12:00:00 +0000'.format(day)))
+        self.assertEqual(writer.flush_count, 2)
+        self.assertEqual(len(CacheManager.get_timeline()), 4)
+        writer.flush()
+        self.assertEqual(writer.flush_count, 3)
+        self.assertEqual(len(CacheManager.get_timeline()), 5)
+
+    def test_timeline_writer_context(self):
+        with CacheManager.timeline_writer() as writer:
+            writer.add(_status('a', 'Wed, 06 May 2015 12:02:30 +0000'))
+            self.assertEqual(CacheManager.get_timeline(), [])
+        self.assertEqual(len(CacheManager.get_timeline()), 1)
+
+    def test_known_items_are_skipped(self):
+        self.assertTrue(CacheManager.add_to_timeline(
+            _status('a', 'Wed, 06 May 2015 12:02:30 +0000')))
+        self.assertFalse(CacheManager.add_to_timeline(
+            _status('a', 'Wed, 06 May 2015 12:02:30 +0000')))
+        # The same guid from a different author is a different post.
+        self.assertTrue(CacheManager.add_to_timeline(
+            _status('a', 'Wed, 06 May 2015 12:02:30 +0000', link='http://example.net/feed.xml')))
+        self.assertEqual(len(CacheManager.get_timeline()), 2)
+
+    def test_seen_index_is_persistent(self):
+        CacheManager.add_to_timeline(_status('a', 'Wed, 06 May 2015 12:02:30 +0000'))
+        CacheManager(self.dir)
+        self.assertTrue(CacheManager.is_cached(_status('a', 'Wed, 06 May 2015 12:02:30 +0000')))
+
+    def test_seen_items_are_forgotten_with_the_timeline(self):
+        CacheManager.timeline_store.max_items = 3
+        for day in range(1, 6):
+            CacheManager.add_to_timeline(_status(str(day),
+                '{:02d} May 2015 12:00:00 +0000'.format(day)))
+        conn = CacheManager.timeline_store._connection()
+        self.assertEqual(sorted(guid for guid, in conn.execute('SELECT guid FROM seen')),
+                ['3', '4', '5'])
+        self.assertFalse(CacheManager.is_cached(_status('1', '01 May 2015 12:00:00 +0000')))
+        # Posts older than the full timeline are not added back.
+        self.assertFalse(CacheManager.add_to_timeline(
+            _status('1', '01 May 2015 12:00:00 +0000')))
+        self.assertEqual([s['guid'] for s in CacheManager.get_timeline()], ['5', '4', '3'])
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM seen').fetchone()[0], 3)
+
+    def test_timeline_writer_counts_skipped(self):
+        CacheManager.add_to_timeline(_status('a', 'Wed, 06 May 2015 12:02:30 +0000'))
+        with CacheManager.timeline_writer() as writer:
+            writer.add(_status('a', 'Wed, 06 May 2015 12:02:30 +0000'))
+            writer.add(_status('b', 'Thu, 07 May 2015 12:02:30 +0000'))
+            writer.add(_status('b', 'Thu, 07 May 2015 12:02:30 +0000'))
+        self.assertEqual(writer.skipped_count, 2)
+        self.assertEqual(len(CacheManager.get_timeline()), 2)
+
+    def test_cursor_pagination(self):
+        for day in range(1, 10):
+            CacheManager.add_to_timeline(_status(str(day),
+                '{:02d} May 2015 12:00:00 +0000'.format(day)))
+        first = [s['guid'] for s in CacheManager.get_timeline_page(3)]
+        self.assertEqual(first, ['9', '8', '7'])
+        second = [s['guid'] for s in CacheManager.get_timeline_after(first[-1], 3)]
+        self.assertEqual(second, ['6', '5', '4'])
+        previous = [s['guid'] for s in CacheManager.get_timeline_before(second[0], 3)]
+        self.assertEqual(previous, first)
+        self.assertEqual(CacheManager.get_timeline_after('missing', 3), [])
+
+    def test_cursor_pagination_with_equal_pubdates(self):
+        for guid in ['a', 'b', 'c', 'd']:
+            CacheManager.add_to_timeline(_status(guid, 'Wed, 06 May 2015 12:02:30 +0000'))
+        self.assertEqual([s['guid'] for s in CacheManager.get_timeline_after('b', 5)], ['c', 'd'])
+        self.assertEqual([s['guid'] for s in CacheManager.get_timeline_before('c', 5)], ['a', 'b'])
+
+    def _query_plan(self, query, args):
+        conn = CacheManager.timeline_store._connection()
+        return ' '.join(row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, args))
+
+    def test_cursor_pages_seek_the_index(self):
+        for query in (timelinestore.AFTER.format('>', '1'), timelinestore.BEFORE.format('1')):
+            plan = self._query_plan(query, (1, 1, 1, 25))
+            self.assertTrue(plan.startswith('SEARCH timeline USING INDEX timeline_order'), plan)
+            self.assertFalse('TEMP B-TREE' in plan, plan)
+
+    def test_link_limited_pages_read_in_order(self):
+        store = CacheManager.timeline_store
+        links = store._links_filter(store._connection(), ['http://example.com/feed.xml'])
+        for query, args in ((timelinestore.AFTER.format('>', links), (1, 1, 1, 25)),
+                (timelinestore.BEFORE.format(links), (1, 1, 1, 25)),
+                ('SELECT item FROM timeline WHERE {} {} LIMIT ?'.format(
+                    links, timelinestore.ORDER), (25,))):
+            plan = self._query_plan(query, args)
+            self.assertTrue('USING INDEX timeline_order' in plan, plan)
+            self.assertFalse('TEMP B-TREE' in plan, plan)
+
+    def test_timeline_limited_to_links(self):
+        CacheManager.add_to_timeline(_status('a', '06 May 2015 12:00:00 +0000'))
+        CacheManager.add_to_timeline(_status('b', '07 May 2015 12:00:00 +0000',
+            link='http://example.com/other.xml'))
+        CacheManager.add_to_timeline(dict(_status('c', '08 May 2015 12:00:00 +0000',
+            link='http://example.com/'), feed_link='http://example.com/feed.xml'))
+        links = ['http://example.com/feed.xml']
+        self.assertEqual([s['guid'] for s in CacheManager.get_timeline_page(5, links)],
+                ['c', 'a'])
+        self.assertEqual([s['guid'] for s in CacheManager.get_timeline_after('c', 5, links)],
+                ['a'])
+        self.assertEqual([s['guid'] for s in CacheManager.get_timeline_before('a', 5, links)],
+                ['c'])
+        self.assertEqual(CacheManager.get_timeline_page(5, []), [])
+
+    def test_link_column_added_to_old_timelines(self):
+        location = os.path.join(self.dir, 'old.db')
+        conn = sqlite3.connect(location)
+        conn.execute('CREATE TABLE timeline (id INTEGER PRIMARY KEY, guid TEXT, '
+                'pubdate INTEGER NOT NULL, item TEXT NOT NULL)')
+        conn.execute('INSERT INTO timeline (guid, pubdate, item) VALUES (?, ?, ?)',
+                ('a', 1, json.dumps(_status('a', '06 May 2015 12:00:00 +0000'))))
+        conn.commit()
+        conn.close()
+        store = SQLiteTimelineStore(location)
+        self.assertEqual([s['guid'] for s in store.page(links=['http://example.com/feed.xml'])],
+                ['a'])
+
+    def test_pubdate_added_to_old_seen_tables(self):
+        location = os.path.join(self.dir, 'old.db')
+        conn = sqlite3.connect(location)
+        conn.execute('CREATE TABLE seen (link TEXT, guid TEXT, PRIMARY KEY (link, guid))')
+        conn.execute('INSERT INTO seen (link, guid) VALUES (?, ?)',
+                ('http://example.com/feed.xml', 'a'))
+        conn.commit()
+        conn.close()
+        store = SQLiteTimelineStore(location)
+        self.assertTrue(store.is_seen(('http://example.com/feed.xml', 'a')))
+        self.assertFalse(store.add(_status('a', '06 May 2015 12:00:00 +0000'), 1,
+            ('http://example.com/feed.xml', 'a')))
+
+    def test_profiles_are_cached(self):
+        link = 'http://example.com/feed.xml'
+        self.assertEqual(CacheManager.get_profiles([link]), {})
+        CacheManager.cache_profiles({link: {'username': 'eric.idle', 'link': link}})
+        CacheManager.cache_profiles({link: {'username': 'michael.palin', 'link': link}})
+        profiles = CacheManager.get_profiles([link, 'http://example.com/other.xml'])
+        self.assertEqual(profiles.keys(), [link])
+        self.assertEqual(profiles[link]['username'], 'michael.palin')
+
+    def test_old_profiles_expire(self):
+        link = 'http://example.com/feed.xml'
+        other = 'http://example.com/other.xml'
+        CacheManager.cache_profiles({link: {'link': link}, other: {'link': other}})
+        conn = CacheManager.timeline_store._connection()
+        with conn:
+            conn.execute('UPDATE profiles SET updated = updated - ?',
+                    (CacheManager.max_profile_age + 1,))
+        self.assertEqual(CacheManager.get_profiles([link, other]), {})
+        CacheManager.cache_profiles({other: {'link': other}})
+        self.assertEqual(CacheManager.get_profiles([link, other]).keys(), [other])
+        self.assertEqual([row[0] for row in conn.execute('SELECT link FROM profiles')], [other])
+
+    def test_no_profiles_without_a_cache(self):
+        store = CacheManager.timeline_store
+        CacheManager.timeline_store = None
+        try:
+            self.assertEqual(CacheManager.get_profiles(['http://example.com/feed.xml']), {})
+        finally:
+            CacheManager.timeline_store = store
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(CacheManagerTest)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,46 @@
+""" Tests for the feed item index. """
+
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+
+sys.path.insert(0, '../')
+from feedindex import SQLiteFeedIndex
+
+
+class SQLiteFeedIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.index = SQLiteFeedIndex(os.path.join(self.dir, 'feed.xml.index.db'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_rebuild(self):
+        self.assertFalse(self.index.is_built())
+        self.index.rebuild([('archive/feed_1.xml', ['a', 'b']), ('feed.xml', ['c'])])
+        self.assertTrue(self.index.is_built())
+        self.assertEqual(self.index.lookup('b'), ('archive/feed_1.xml', 1))
+        self.assertEqual(self.index.lookup('c'), ('feed.xml', 0))
+        self.assertEqual(self.index.lookup('d'), None)
+
+    def test_move_page(self):
+        self.index.index_page('feed.xml', ['a', 'b'])
+        self.index.move_page('feed.xml', 'archive/feed_1.xml')
+        self.assertEqual(self.index.lookup('b'), ('archive/feed_1.xml', 1))
+
+    def test_remove_shifts_later_items(self):
+        self.index.index_page('feed.xml', ['a', 'b', 'c'])
+        self.index.index_page('archive/feed_1.xml', ['d', 'e'])
+        self.index.remove('a')
+        self.assertEqual(self.index.lookup('a'), None)
+        self.assertEqual(self.index.lookup('c'), ('feed.xml', 1))
+        self.assertEqual(self.index.lookup('e'), ('archive/feed_1.xml', 1))
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(SQLiteFeedIndexTest)
+    unittest.TextTestRunner(verbosity=2).run(suite)
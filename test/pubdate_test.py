@@ -0,0 +1,48 @@
+""" Tests for the pubdate parser. """
+
+import unittest
+import sys
+
+from dateutil.parser import parse
+
+sys.path.insert(0, '../')
+from pubdate import parse_pubdate, parse_rfc822, to_epoch, item_epoch, from_epoch
+
+
+class PubdateTest(unittest.TestCase):
+
+    def test_matches_dateutil(self):
+        for date_str in ['Thu, 12 Mar 2015 05:33:41 +0000',
+                'Wed, 08 Apr 2015 21:25:41 -0700',
+                'Fri, 1 May 2015 8:00:00 +0530',
+                'Sat, 30 May 2015 09:03:00 GMT',
+                'Mon, 29 Dec 2014 16:45:00']:
+            self.assertEqual(parse_pubdate(date_str), parse(date_str))
+            self.assertEqual(parse_pubdate(date_str).utcoffset(), parse(date_str).utcoffset())
+
+    def test_falls_back_to_dateutil(self):
+        date_str = 'Thu, May 7 2015 12:02:30 +0000'
+        self.assertEqual(parse_rfc822(date_str), None)
+        self.assertEqual(parse_pubdate(date_str), parse(date_str))
+
+    def test_invalid_date_falls_back(self):
+        self.assertEqual(parse_rfc822('Thu, 31 Feb 2015 12:02:30 +0000'), None)
+        self.assertRaises(ValueError, parse_pubdate, 'Thu, 31 Feb 2015 12:02:30 +0000')
+
+    def test_to_epoch(self):
+        self.assertEqual(to_epoch('Thu, 01 Jan 1970 00:01:00 +0000'), 60)
+        self.assertEqual(to_epoch('Thu, 01 Jan 1970 01:01:00 +0100'), 60)
+
+    def test_item_epoch_is_stored(self):
+        item = {'pubdate': 'Thu, 01 Jan 1970 00:01:00 +0000'}
+        self.assertEqual(item_epoch(item), 60)
+        self.assertEqual(item['pubdate_epoch'], 60)
+        # The stored epoch is used from then on.
+        item['pubdate'] = 'garbage'
+        self.assertEqual(item_epoch(item), 60)
+        self.assertEqual(from_epoch(60), parse_pubdate('Thu, 01 Jan 1970 00:01:00 +0000'))
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(PubdateTest)
+    unittest.TextTestRunner(verbosity=2).run(suite)
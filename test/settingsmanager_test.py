@@ -0,0 +1,159 @@
+""" Tests for the SettingsManager. """
+
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+
+sys.path.insert(0, '../')
+import settingsmanager
+from settingsmanager import SettingsManager
+from settingsstore import SQLiteSettingsStore
+
+
+class SettingsManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.location = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        os.remove(self.location)
+        SettingsManager.use_store(None)
+        SettingsManager(self.location)
+        SettingsManager.reset_cache_stats()
+
+    def tearDown(self):
+        os.remove(self.location)
+
+    def test_add_and_get(self):
+        SettingsManager.add('domain', 'example.com')
+        self.assertEqual(SettingsManager.get('domain'), 'example.com')
+        self.assertEqual(SettingsManager.get('missing'), None)
+
+    def test_repeated_gets_read_file_once(self):
+        SettingsManager.add('domain', 'example.com')
+        SettingsManager.reset_cache_stats()
+        for _ in range(6):
+            SettingsManager.get('domain')
+        stats = SettingsManager.cache_stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 5)
+
+    def test_external_write_invalidates_snapshot(self):
+        SettingsManager.add('domain', 'example.com')
+        SettingsManager.get('domain')
+        with open(self.location, 'w') as f:
+            f.write('{"domain": "example.net", "padding": true}')
+        self.assertEqual(SettingsManager.get('domain'), 'example.net')
+
+    def test_username_index(self):
+        SettingsManager.add_user('john.cleese', 'hash', 'uid1',
+                'user/uid1/feed.xml', 'user/uid1/blocks.xml', 'user/uid1/follows.xml')
+        SettingsManager.add_user('eric.idle', 'hash', 'uid2',
+                'user/uid2/feed.xml', 'user/uid2/blocks.xml', 'user/uid2/follows.xml')
+        self.assertEqual(SettingsManager.get_user_id_for_username('eric.idle'), 'uid2')
+        self.assertEqual(SettingsManager.get_user_by_username('john.cleese')['feed_location'],
+                'user/uid1/feed.xml')
+        self.assertEqual(SettingsManager.get_user_by_username('nobody'), None)
+
+    def test_username_index_follows_renames(self):
+        SettingsManager.add_user('john.cleese', 'hash', 'uid1',
+                'user/uid1/feed.xml', 'user/uid1/blocks.xml', 'user/uid1/follows.xml')
+        SettingsManager.get_user_id_for_username('john.cleese')
+        SettingsManager.add_user('graham.chapman', 'hash', 'uid1',
+                'user/uid1/feed.xml', 'user/uid1/blocks.xml', 'user/uid1/follows.xml')
+        self.assertEqual(SettingsManager.get_user_id_for_username('john.cleese'), None)
+        self.assertEqual(SettingsManager.get_user_id_for_username('graham.chapman'), 'uid1')
+
+    def test_reads_do_not_share_the_snapshot(self):
+        SettingsManager.add('languages', ['en'])
+        SettingsManager.add_user('john.cleese', 'hash', 'uid1',
+                'user/uid1/feed.xml', 'user/uid1/blocks.xml', 'user/uid1/follows.xml')
+        SettingsManager.get('languages').append('fr')
+        SettingsManager.get_user('uid1')['pwd_hash'] = 'changed'
+        SettingsManager.get_user_by_username('john.cleese')['pwd_hash'] = 'changed'
+        self.assertEqual(SettingsManager.get('languages'), ['en'])
+        self.assertEqual(SettingsManager.get_user('uid1')['pwd_hash'], 'hash')
+
+    def test_username_index_follows_registry_writes(self):
+        SettingsManager.add_user('john.cleese', 'hash', 'uid1',
+                'user/uid1/feed.xml', 'user/uid1/blocks.xml', 'user/uid1/follows.xml')
+        SettingsManager.get_user_id_for_username('john.cleese')
+        SettingsManager.add('registered_users', {'uid2': {'username': 'eric.idle'}})
+        self.assertEqual(SettingsManager.get_user_id_for_username('john.cleese'), None)
+        self.assertEqual(SettingsManager.get_user_id_for_username('eric.idle'), 'uid2')
+
+    def test_racing_write_is_not_hidden(self):
+        SettingsManager.add('domain', 'example.com')
+        SettingsManager.get('domain')
+        to_settings = settingsmanager.to_settings
+        def racing_to_settings(location, key, value):
+            # Another process writes just before this one does.
+            to_settings(location, 'theme', 'dark')
+            return to_settings(location, key, value)
+        settingsmanager.to_settings = racing_to_settings
+        try:
+            SettingsManager.add('domain', 'example.net')
+        finally:
+            settingsmanager.to_settings = to_settings
+        self.assertEqual(SettingsManager.get('domain'), 'example.net')
+        self.assertEqual(SettingsManager.get('theme'), 'dark')
+
+
+class StoreSnapshotTest(unittest.TestCase):
+    """ Tests the snapshot when settings are kept in a SQLite store. """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db_location = os.path.join(self.dir, 'settings.db')
+        SettingsManager.use_store(SQLiteSettingsStore(self.db_location))
+        SettingsManager.reset_cache_stats()
+
+    def tearDown(self):
+        SettingsManager.use_store(None)
+        shutil.rmtree(self.dir)
+
+    def test_repeated_gets_read_store_once(self):
+        SettingsManager.add('domain', 'example.com')
+        SettingsManager.reset_cache_stats()
+        for _ in range(6):
+            self.assertEqual(SettingsManager.get('domain'), 'example.com')
+        stats = SettingsManager.cache_stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 5)
+
+    def test_write_through_other_connection_invalidates_snapshot(self):
+        SettingsManager.add('domain', 'example.com')
+        SettingsManager.get('domain')
+        SQLiteSettingsStore(self.db_location).add('domain', 'example.net')
+        self.assertEqual(SettingsManager.get('domain'), 'example.net')
+
+    def test_racing_write_is_not_hidden(self):
+        SettingsManager.add('domain', 'example.com')
+        SettingsManager.get('domain')
+        store = SettingsManager.store
+        add = store.add
+        def racing_add(key, value):
+            # Another process writes just before this one does.
+            SQLiteSettingsStore(self.db_location).add('theme', 'dark')
+            return add(key, value)
+        store.add = racing_add
+        try:
+            SettingsManager.add('domain', 'example.net')
+        finally:
+            del store.add
+        self.assertEqual(SettingsManager.get('domain'), 'example.net')
+        self.assertEqual(SettingsManager.get('theme'), 'dark')
+
+    def test_registered_users_come_from_the_store(self):
+        SettingsManager.get('domain')
+        SettingsManager.add_user('john.cleese', 'hash', 'uid1',
+                'user/uid1/feed.xml', 'user/uid1/blocks.xml', 'user/uid1/follows.xml')
+        self.assertEqual(SettingsManager.get('registered_users').keys(), ['uid1'])
+        self.assertEqual(SettingsManager.get_user_id_for_username('john.cleese'), 'uid1')
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(SettingsManagerTest)
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(StoreSnapshotTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
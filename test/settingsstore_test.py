@@ -0,0 +1,70 @@
+""" Tests for the SQLite settings store. """
+
+import unittest
+import sys
+import os
+import json
+import shutil
+import tempfile
+
+sys.path.insert(0, '../')
+from settingsstore import SQLiteSettingsStore, migrate_json_settings
+
+
+class SQLiteSettingsStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db_location = os.path.join(self.dir, 'settings.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_wal_mode(self):
+        store = SQLiteSettingsStore(self.db_location)
+        mode = store._connection().execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual(mode, 'wal')
+
+    def test_add_and_get(self):
+        store = SQLiteSettingsStore(self.db_location)
+        store.add('max_posts_per_feed', 500)
+        self.assertEqual(store.get('max_posts_per_feed'), 500)
+        self.assertEqual(store.get('missing'), None)
+
+    def test_add_and_get_user(self):
+        store = SQLiteSettingsStore(self.db_location)
+        store.add_user('john.cleese', 'hash', 'uid1', 'user/uid1/feed.xml',
+                'user/uid1/blocks.xml', 'user/uid1/follows.xml')
+        self.assertEqual(store.get_user_id_for_username('john.cleese'), 'uid1')
+        self.assertEqual(store.get_user('uid1')['feed_location'], 'user/uid1/feed.xml')
+        self.assertEqual(store.user_count(), 1)
+        self.assertRaises(KeyError, store.get_user, 'uid2')
+
+    def test_migrate_json_settings(self):
+        json_location = os.path.join(self.dir, 'settings.json')
+        with open(json_location, 'w') as f:
+            f.write(json.dumps({
+                'domain': 'example.com',
+                'registered_users': {
+                    'uid1': {
+                        'username': 'john.cleese',
+                        'pwd_hash': 'hash',
+                        'feed_location': 'user/uid1/feed.xml',
+                        'blocks_location': 'user/uid1/blocks.xml',
+                        'follows_location': 'user/uid1/follows.xml'
+                        }
+                    }
+                }))
+        store = migrate_json_settings(json_location, self.db_location)
+        self.assertEqual(store.get('domain'), 'example.com')
+        self.assertEqual(store.get_user_id_for_username('john.cleese'), 'uid1')
+
+        # The migration only happens once.
+        store.add('domain', 'example.net')
+        store = migrate_json_settings(json_location, self.db_location)
+        self.assertEqual(store.get('domain'), 'example.net')
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(SQLiteSettingsStoreTest)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -2,10 +2,26 @@
 
 import unittest
 import sys
+import os
+import shutil
+import tempfile
 
-sys.path.insert(0, '../')
-from model.user import User, cache_users
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from datetime import datetime
+
+from dateutil.tz import tzutc
+from lxml import etree
+
+import util as u
+from cachemanager import CacheManager
+from settingsmanager import SettingsManager
+from model.user import User, cache_users, _paginate, _feed_pages, _find_item, \
+        _remove_item, _read_user_list, _listed_user, _set_profiles, SETTERS
 from model.user import DataLocations as dl
+from model.status import Status, StatusType
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'user')
 
 
 class UserTest(unittest.TestCase):
@@ -18,6 +34,18 @@ class UserTest(unittest.TestCase):
     @since 2015-04-14
     """
 
+    def setUp(self):
+        # Run against a copy of the fixtures, since the tests write to
+        # the feeds (and to the meta, index and gzip files next to them).
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        shutil.copytree('user', os.path.join(self.dir, 'user'))
+        os.chdir(self.dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
     # Some internals testing to make sure everything
     # starts out ok.
 
@@ -450,6 +478,38 @@ class UserTest(unittest.TestCase):
         self.assertEqual(user.relocate_url, relocate_url)
 
 
+    # Batched Writes
+
+    def test_local_batch(self):
+        user = User(local_url='user/feed.xml')
+        with user.batch():
+            user.link = 'http://example.org'
+            user.language = 'fr'
+        self.assertEqual(user.link, 'http://example.org')
+        self.assertEqual(user.language, 'fr')
+        user.language = 'en'
+
+    def test_local_update(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            location = os.path.join(temp_dir, 'feed.xml')
+            shutil.copy('user/feed.xml', location)
+            user = User(local_url=location)
+            user.update(link='http://example.com', docs_url='http://example.com/docs')
+            self.assertEqual(user.link, 'http://example.com')
+            self.assertEqual(user.docs_url, 'http://example.com/docs')
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_cached_update(self):
+        user = User(entries={ 'link': 'http://example.com' })
+        user.update(link='http://example.net')
+        self.assertEqual(user.link, 'http://example.net')
+
+    def test_update_unknown_property(self):
+        user = User(entries={})
+        self.assertRaises(AttributeError, user.update, spam='eggs')
+
     ################# Methods ###################
 
     #def test_add_and_delete_post(self):
@@ -478,10 +538,311 @@ class UserTest(unittest.TestCase):
     # There's only 1 home timeline test because
     # it doesn't matter what kind of user it is.
     def test_home_timeline(self):
+        # Without a timeline cache there is nothing to show.
+        CacheManager()
         user = User(local_url='user/feed.xml')
-        timeline = user.home_timeline()
-        self.assertTrue(len(timeline) > 0)
+        self.assertEqual(user.home_timeline(), [])
+
+
+class FixtureDirTestCase(unittest.TestCase):
+    """ Runs each test against a copy of the FIXTURE file (in test/user)
+    at self.location, in a temp dir that is removed afterwards. """
+
+    FIXTURE = 'feed.xml'
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.location = os.path.join(self.dir, self.FIXTURE)
+        shutil.copy(os.path.join(FIXTURES, self.FIXTURE), self.location)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+
+class PaginationTest(FixtureDirTestCase):
+    """ Tests moving a feed's items to archive pages. """
+
+    def test_paginate(self):
+        _paginate(self.location)
+        tree = u.get_user_feed(self.location)
+        self.assertEqual(len(tree.xpath('//item')), 0)
+        self.assertEqual(tree.xpath('//next_node')[0].text,
+                'http://example.com/archive/feed_1.xml')
+
+        pages = _feed_pages(self.location)
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(pages[0]['items'], 5)
+        self.assertEqual(pages[0]['first_pubdate'], 1426138421)
+        self.assertEqual(pages[0]['last_pubdate'], 1428531413)
+        page = u.get_user_feed(pages[0]['file'])
+        self.assertEqual(len(page.xpath('//item')), 5)
+
+    def test_paginate_prefixed_feed(self):
+        with open(self.location, 'w') as f:
+            f.write('<rss><channel xmlns:microblog="http://openmicroblog.com/">'
+                    '<microblog:link>http://example.com/eric.idle</microblog:link>'
+                    '<item><microblog:guid>1</microblog:guid>'
+                    '<microblog:pubdate>Thu, 12 Mar 2015 05:33:41 +0000</microblog:pubdate></item>'
+                    '</channel></rss>')
+        _paginate(self.location)
+        pages = _feed_pages(self.location)
+        self.assertEqual(pages[0]['url'], 'http://example.com/eric.idle/archive/feed_1.xml')
+        self.assertEqual(pages[0]['first_pubdate'], 1426138421)
+        location, tree, item = _find_item(self.location, '1')
+        self.assertEqual(location, pages[0]['file'])
+
+    def test_pages_are_chained(self):
+        _paginate(self.location)
+        u.append_user_feed_item(self.location, etree.fromstring(
+            '<item><guid>1</guid><pubdate>Thu, 09 Apr 2015 10:00:00 +0000</pubdate></item>'))
+        _paginate(self.location)
+
+        pages = _feed_pages(self.location)
+        self.assertEqual([page['items'] for page in pages], [5, 1])
+        head = u.get_user_feed(self.location)
+        self.assertEqual(head.xpath('//next_node')[0].text, pages[1]['url'])
+        newest_page = u.get_user_feed(pages[1]['file'])
+        self.assertEqual(newest_page.xpath('//next_node')[0].text, pages[0]['url'])
+
+    def test_new_post_starts_the_new_page(self):
+        settings_location = SettingsManager.settings_file_location
+        SettingsManager.use_store(None)
+        SettingsManager(os.path.join(self.dir, 'settings.json'))
+        SettingsManager.add('max_posts_per_feed', 3)
+        try:
+            user = User(local_url=self.location)
+            for i in range(8):
+                user.add_post(Status({'guid': 'g{}'.format(i), 'reply': '', 'language': 'en',
+                    'description': 'Status {}'.format(i),
+                    'pubdate': 'Fri, 10 Apr 2015 10:0{}:00 +0000'.format(i)},
+                    status_type=StatusType.STATUS))
+        finally:
+            SettingsManager(settings_location)
+        head = u.get_user_feed(self.location)
+        self.assertEqual([guid.text for guid in head.xpath('//item/guid')], ['g6', 'g7'])
+        self.assertEqual([page['items'] for page in _feed_pages(self.location)], [5, 3, 3])
+
+
+class ItemIndexTest(FixtureDirTestCase):
+    """ Tests finding and removing items through the feed's item index. """
+
+    def test_find_item_on_archive_page(self):
+        _paginate(self.location)
+        location, tree, item = _find_item(self.location, '3582529430775704908880978207502629792')
+        self.assertEqual(location, _feed_pages(self.location)[0]['file'])
+        self.assertEqual(item.findtext('description'), 'Does it work now?')
+
+    def test_remove_item(self):
+        guid = '57246381026082873347455464435381419970'
+        self.assertTrue(_remove_item(self.location, guid))
+        self.assertEqual(_find_item(self.location, guid), None)
+        self.assertFalse(_remove_item(self.location, guid))
+        # Items after the removed one are still found.
+        location, tree, item = _find_item(self.location, '270802495814837847338094768161200415839')
+        self.assertEqual(item.findtext('pubdate'), 'Wed, 08 Apr 2015 22:16:53 +0000')
+
+    def test_index_is_rebuilt_after_outside_changes(self):
+        _find_item(self.location, 'missing')
+        tree = u.get_user_feed(self.location)
+        item = tree.xpath('//item')[0]
+        item.getparent().remove(item)
+        with open(self.location, 'w') as f:
+            tree.write(f)
+        location, tree, item = _find_item(self.location, '270802495814837847338094768161200415839')
+        self.assertEqual(item.findtext('pubdate'), 'Wed, 08 Apr 2015 22:16:53 +0000')
+
+
+class TimelineRangeTest(FixtureDirTestCase):
+    """ Tests reading a local user's timeline across archive pages. """
+
+    def setUp(self):
+        super(TimelineRangeTest, self).setUp()
+        # Archive the March posts, and leave the April posts in the feed.
+        tree = u.get_user_feed(self.location)
+        for item in tree.xpath('//item')[2:]:
+            item.getparent().remove(item)
+        u.write_user_feed(tree, self.location)
+        _paginate(self.location)
+        tree = u.get_user_feed(os.path.join(FIXTURES, 'feed.xml'))
+        for item in tree.xpath('//item')[2:]:
+            u.append_user_feed_item(self.location, item)
+        self.user = User(local_url=self.location)
+
+    def test_timeline_spans_pages(self):
+        timeline = self.user.user_timeline(n=None)
+        self.assertEqual(len(timeline), 5)
+        epochs = [status.pubdate_epoch for status in timeline]
+        self.assertEqual(epochs, sorted(epochs, reverse=True))
+
+    def test_range_skips_pages(self):
+        # Only April is asked for, so the archive page is never opened.
+        page = _feed_pages(self.location)[0]['file']
+        os.remove(page)
+        timeline = self.user.user_timeline(since=datetime(2015, 4, 1, tzinfo=tzutc()))
+        self.assertEqual(len(timeline), 3)
+
+    def test_range_on_archive_page(self):
+        timeline = self.user.user_timeline(
+                since=datetime(2015, 3, 1, tzinfo=tzutc()),
+                until=datetime(2015, 3, 31, tzinfo=tzutc()))
+        self.assertEqual([status.description for status in timeline],
+                ['Yo again', 'PLEASE WORK!'])
+
+    def test_n_stops_early(self):
+        page = _feed_pages(self.location)[0]['file']
+        os.remove(page)
+        self.assertEqual(len(self.user.user_timeline(n=2)), 2)
+
+    def test_start_stops_early(self):
+        # The start post is in the feed, so the archive page is never opened.
+        page = _feed_pages(self.location)[0]['file']
+        os.remove(page)
+        timeline = self.user.user_timeline(start='195047109921368453155940912994152813925', n=2)
+        self.assertEqual([status.description for status in timeline],
+                ['Do, do, do, do.', 'Does it work now?'])
+
+    def test_start_on_archive_page(self):
+        timeline = self.user.user_timeline(start='57246381026082873347455464435381419970', n=5)
+        self.assertEqual([status.description for status in timeline],
+                ['Yo again', 'PLEASE WORK!'])
+        status = self.user.user_timeline(start='57246381026082873347455464435381419970', n=0)
+        self.assertEqual(status.description, 'Yo again')
+
+    def test_start_with_previous_posts(self):
+        timeline = self.user.user_timeline(start='3582529430775704908880978207502629792', n=-2)
+        self.assertEqual([status.description for status in timeline],
+                ['Does it work now?', 'Do, do, do, do.'])
+
+    def test_iter_timeline_is_lazy(self):
+        page = _feed_pages(self.location)[0]['file']
+        os.remove(page)
+        timeline = self.user.iter_timeline()
+        self.assertEqual(next(timeline).description, None)
+        self.assertEqual(next(timeline).description, 'Do, do, do, do.')
+
+    def test_items_out_of_order(self):
+        u.append_user_feed_item(self.location, etree.fromstring(
+            '<item><guid>1</guid><pubdate>Wed, 08 Apr 2015 22:14:00 +0000</pubdate></item>'))
+        timeline = self.user.user_timeline(n=3)
+        self.assertEqual([status.guid for status in timeline],
+                ['270802495814837847338094768161200415839', '1',
+                    '195047109921368453155940912994152813925'])
+
+
+class HomeTimelineTest(FixtureDirTestCase):
+    """ Tests reading the home timeline from the timeline cache. """
+
+    FOLLOWED = 'http://microblog.brianschrader.com/feed'
+
+    def setUp(self):
+        super(HomeTimelineTest, self).setUp()
+        CacheManager(cache_location=self.dir)
+        for guid, day, link in (('a', 6, self.FOLLOWED), ('b', 7, self.FOLLOWED),
+                ('c', 8, self.FOLLOWED), ('own', 9, 'http://example.com'),
+                ('stranger', 10, 'http://example.com/feed.xml')):
+            CacheManager.add_to_timeline({
+                'guid': guid,
+                'pubdate': '{:02d} May 2015 12:02:30 +0000'.format(day),
+                'description': 'Status {}'.format(guid),
+                'user': {'link': link, 'username': 'eric.idle'}
+                })
+        # Register the user, with their files in the temp dir.
+        self.settings_location = SettingsManager.settings_file_location
+        SettingsManager.use_store(None)
+        SettingsManager(os.path.join(self.dir, 'settings.json'))
+        blocks_location = os.path.join(self.dir, 'blocks.xml')
+        follows_location = os.path.join(self.dir, 'follows.xml')
+        shutil.copy(self.location, blocks_location)
+        shutil.copy(os.path.join(FIXTURES, 'follows.xml'), follows_location)
+        self.user = User(local_url=self.location)
+        SettingsManager.add_user(self.user.username, 'hash', self.user.user_id,
+                self.location, blocks_location, follows_location)
+
+    def tearDown(self):
+        CacheManager()
+        SettingsManager(self.settings_location)
+        super(HomeTimelineTest, self).tearDown()
+
+    def test_home_timeline_from_cache(self):
+        timeline = self.user.home_timeline(n=2)
+        self.assertEqual([status.guid for status in timeline], ['own', 'c'])
+        self.assertEqual(timeline[0].user.username, 'eric.idle')
+
+    def test_home_timeline_pages(self):
+        timeline = self.user.home_timeline(start='b')
+        self.assertEqual([status.guid for status in timeline], ['a'])
+
+    def test_home_timeline_skips_unfollowed_feeds(self):
+        guids = [status.guid for status in self.user.home_timeline()]
+        self.assertEqual(guids, ['own', 'c', 'b', 'a'])
+
+    def test_home_timeline_without_cache(self):
+        CacheManager()
+        self.assertEqual(self.user.home_timeline(), [])
+
+
+class FollowsListTest(FixtureDirTestCase):
+    """ Tests reading follows lists without fetching any feeds. """
+
+    FIXTURE = 'follows.xml'
+    LINK = 'http://microblog.brianschrader.com/feed'
+
+    def test_read_user_list(self):
+        entries = _read_user_list(self.location)
+        self.assertEqual(entries, [{'user_id': '1234567890',
+            'user_name': 'sonicthetester', 'user_link': self.LINK}])
+
+    def test_listed_user_without_profile(self):
+        user = _listed_user(_read_user_list(self.location)[0])
+        self.assertEqual(user._status, dl.CACHED)
+        self.assertEqual(user.username, 'sonicthetester')
+        self.assertEqual(user.link, self.LINK)
+
+    def test_listed_user_with_profile(self):
+        entry = _read_user_list(self.location)[0]
+        user = _listed_user(entry, {'username': 'sonic', 'user_full_name': 'Sonic',
+            'description': None})
+        self.assertEqual(user.username, 'sonic')
+        self.assertEqual(user.full_name, 'Sonic')
+        self.assertEqual(user.user_id, '1234567890')
+
+
+class SetProfilesTest(unittest.TestCase):
+    """ Tests filling in users from the profiles of their feeds. """
+
+    def test_setters_by_binding(self):
+        self.assertEqual(SETTERS['username'], User.__dict__['set_username'])
+        self.assertEqual(SETTERS['user_full_name'], User.__dict__['set_full_name'])
+        self.assertNotIn('follows_items', SETTERS)
+
+    def test_profiles_are_matched_by_feed_url(self):
+        eric = User(remote_url='http://example.com/eric.xml')
+        john = User(remote_url='http://example.com/john.xml')
+        _set_profiles([eric, john], {
+            'http://example.com/john.xml': {'username': 'john.cleese', 'unknown': 1},
+            'http://example.com/eric.xml': {'username': 'eric.idle',
+                'user_full_name': 'Eric Idle'},
+            })
+        self.assertEqual(eric._status, dl.CACHED)
+        self.assertEqual(eric.username, 'eric.idle')
+        self.assertEqual(eric.full_name, 'Eric Idle')
+        self.assertEqual(john.username, 'john.cleese')
+        self.assertIsNone(john.full_name)
+        self.assertNotIn('unknown', john.__dict__)
+
+    def test_missing_profile(self):
+        user = User(remote_url='http://example.com/eric.xml')
+        _set_profiles([user], {})
+        self.assertEqual(user._status, dl.CACHED)
+        self.assertIsNone(user.username)
+
 
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(UserTest)
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(PaginationTest))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(ItemIndexTest))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TimelineRangeTest))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(HomeTimelineTest))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(FollowsListTest))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(SetProfilesTest))
     unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,180 @@
+""" Tests for the feed IO utilities. """
+
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import gzip
+
+from lxml.builder import E
+from lxml import etree
+
+sys.path.insert(0, '../')
+import util as u
+
+
+class FeedCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.location = os.path.join(self.dir, 'feed.xml')
+        u.write_user_feed(etree.ElementTree(E.channel(E.username('john.cleese'))),
+                self.location)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_read_only_feeds_are_shared(self):
+        first = u.get_user_feed(self.location, read_only=True)
+        second = u.get_user_feed(self.location, read_only=True)
+        self.assertTrue(first is second)
+
+    def test_writable_feeds_are_not_shared(self):
+        shared = u.get_user_feed(self.location, read_only=True)
+        self.assertFalse(u.get_user_feed(self.location) is shared)
+
+    def test_write_invalidates(self):
+        u.get_user_feed(self.location, read_only=True)
+        tree = u.get_user_feed(self.location)
+        tree.xpath('//username')[0].text = 'eric.idle'
+        u.write_user_feed(tree, self.location)
+        tree = u.get_user_feed(self.location, read_only=True)
+        self.assertEqual(tree.xpath('//username')[0].text, 'eric.idle')
+
+    def test_cache_is_bounded(self):
+        for i in range(u.FEED_CACHE_SIZE + 5):
+            location = os.path.join(self.dir, '{}.xml'.format(i))
+            shutil.copy(self.location, location)
+            u.get_user_feed(location, read_only=True)
+        self.assertEqual(len(u._feed_cache), u.FEED_CACHE_SIZE)
+
+
+class FeedHeaderTest(unittest.TestCase):
+
+    def test_header_of_rss_feed(self):
+        header = u.get_user_feed_header('user/feed.xml')
+        self.assertEqual(header['username'], 'john.cleese')
+        self.assertEqual(header['language'], 'en')
+        self.assertFalse('item' in header)
+        self.assertFalse('guid' in header)
+
+    def test_header_of_namespaced_feed(self):
+        fd, location = tempfile.mkstemp(suffix='.xml')
+        os.close(fd)
+        with open(location, 'w') as f:
+            f.write('<channel xmlns:microblog="http://openmicroblog.com/">'
+                    '<microblog:username>eric.idle</microblog:username>'
+                    '<link>http://example.com</link>'
+                    '<item><guid>1</guid><link>http://example.net</link></item>'
+                    '</channel>')
+        header = u.get_user_feed_header(location)
+        os.remove(location)
+        self.assertEqual(header, {'username': 'eric.idle', 'link': 'http://example.com'})
+
+
+class AppendFeedItemTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.location = os.path.join(self.dir, 'feed.xml')
+        shutil.copy('user/feed.xml', self.location)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_append_item(self):
+        meta = u.get_feed_meta(self.location)
+        self.assertEqual(meta['items'], 5)
+        meta = u.append_user_feed_item(self.location, E.item(E.guid('1234'), E.description('Hi')))
+        self.assertEqual(meta['items'], 6)
+        self.assertEqual(meta['size'], os.path.getsize(self.location))
+
+        tree = u.get_user_feed(self.location)
+        items = tree.xpath('//channel/item')
+        self.assertEqual(len(items), 6)
+        self.assertEqual(items[-1].findtext('guid'), '1234')
+
+    def test_meta_is_rebuilt_after_outside_changes(self):
+        u.get_feed_meta(self.location)
+        tree = u.get_user_feed(self.location)
+        item = tree.xpath('//item')[0]
+        item.getparent().remove(item)
+        with open(self.location, 'w') as f:
+            tree.write(f)
+        self.assertEqual(u.get_feed_meta(self.location)['items'], 4)
+
+
+class GzipCopyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.location = os.path.join(self.dir, 'feed.xml')
+        u.write_user_feed(etree.parse('user/feed.xml'), self.location)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read_gzip_copy(self):
+        with gzip.open(u.get_gzip_copy(self.location)) as f:
+            return f.read()
+
+    def test_copy_is_written_with_feed(self):
+        with open(self.location) as f:
+            self.assertEqual(self.read_gzip_copy(), f.read())
+
+    def test_copy_is_updated_after_append(self):
+        with open(self.location) as f:
+            before = f.read()
+        u.append_user_feed_item(self.location, E.item(E.guid('1234')))
+        # Appending doesn't compress the feed; asking for the copy does.
+        with gzip.open(self.location + u.GZIP_SUFFIX) as f:
+            self.assertEqual(f.read(), before)
+        with open(self.location) as f:
+            self.assertEqual(self.read_gzip_copy(), f.read())
+
+    def test_stale_copy_is_rewritten(self):
+        gz_location = self.location + u.GZIP_SUFFIX
+        os.utime(gz_location, (0, 0))
+        self.assertEqual(u.get_gzip_copy(self.location), gz_location)
+        self.assertTrue(os.path.getmtime(gz_location) >= os.path.getmtime(self.location))
+
+    def test_no_copy_without_a_file(self):
+        self.assertEqual(u.get_gzip_copy(os.path.join(self.dir, 'missing.xml')), None)
+
+    def test_validators_change_with_file(self):
+        etag, last_modified = u.file_validators(self.location)
+        self.assertEqual(u.file_validators(self.location)[0], etag)
+        u.append_user_feed_item(self.location, E.item(E.guid('1234')))
+        self.assertNotEqual(u.file_validators(self.location)[0], etag)
+
+
+class ArchiveFeedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.location = os.path.join(self.dir, 'feed.xml')
+        u.write_user_feed(etree.parse('user/feed.xml'), self.location)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_archive_page(self):
+        page = u.archive_user_feed(self.location, 3)
+        self.assertEqual(page, os.path.join(self.dir, 'archive', 'feed_3.xml'))
+        self.assertEqual(u.content_hash(page), u.content_hash(self.location))
+        self.assertEqual(u.get_gzip_copy(page), page + u.GZIP_SUFFIX)
+
+    def test_content_hash_follows_changes(self):
+        digest = u.content_hash(self.location)
+        u.append_user_feed_item(self.location, E.item(E.guid('1234')))
+        self.assertNotEqual(u.content_hash(self.location), digest)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(FeedCacheTest)
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(FeedHeaderTest))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(AppendFeedItemTest))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(GzipCopyTest))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(ArchiveFeedTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,159 @@
+""" Tests for the webserver's feed routes. """
+
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import gzip
+from StringIO import StringIO
+
+from lxml import etree
+
+sys.path.insert(0, '../')
+import util as u
+from settingsmanager import SettingsManager
+import webserver
+
+
+class _ServerTest(unittest.TestCase):
+    """ Registers john.cleese with a feed in a temp dir, and sets up a
+    test client. """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.location = os.path.join(self.dir, 'feed.xml')
+        u.write_user_feed(etree.parse('user/feed.xml'), self.location)
+        with open(self.location, 'rb') as f:
+            self.body = f.read()
+
+        self.settings_location = SettingsManager.settings_file_location
+        SettingsManager.use_store(None)
+        SettingsManager(os.path.join(self.dir, 'settings.json'))
+        SettingsManager.add_user('john.cleese', 'hash', 'uid1', self.location,
+                os.path.join(self.dir, 'blocks.xml'), os.path.join(self.dir, 'follows.xml'))
+        self.client = webserver.app.test_client()
+
+    def tearDown(self):
+        SettingsManager(self.settings_location)
+        shutil.rmtree(self.dir)
+
+    def get(self, path='/john.cleese/feed.xml', **headers):
+        return self.client.get(path, headers=headers)
+
+
+class FeedRouteTest(_ServerTest):
+    """ Tests sending feeds: validators, conditional requests, gzip
+    and byte ranges. """
+
+    def test_feed_has_validators(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, self.body)
+        self.assertEqual(response.headers['ETag'],
+                '"{}"'.format(u.file_validators(self.location)[0]))
+        self.assertTrue('Last-Modified' in response.headers)
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+
+    def test_not_modified(self):
+        etag = self.get().headers['ETag']
+        response = self.get(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, '')
+
+    def test_modified_since(self):
+        last_modified = self.get().headers['Last-Modified']
+        response = self.get(**{'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+    def test_gzip_copy_is_sent(self):
+        response = self.get(**{'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertTrue(response.headers['ETag'].endswith('-gzip"'))
+        self.assertTrue('Accept-Encoding' in response.headers['Vary'])
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(response.data)).read(), self.body)
+
+    def test_stale_gzip_copy_is_rewritten(self):
+        with open(self.location, 'ab') as f:
+            f.write('\n')
+        os.utime(self.location + u.GZIP_SUFFIX, (0, 0))
+        response = self.get(**{'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(response.data)).read(), self.body + '\n')
+
+    def test_range(self):
+        response = self.get(Range='bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, self.body[:10])
+        self.assertEqual(response.headers['Content-Range'],
+                'bytes 0-9/{}'.format(len(self.body)))
+
+    def test_unsatisfiable_range(self):
+        response = self.get(Range='bytes={}-'.format(len(self.body) + 10))
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers['Content-Range'],
+                'bytes */{}'.format(len(self.body)))
+
+    def test_if_range_mismatch_sends_whole_feed(self):
+        response = self.get(Range='bytes=0-9', **{'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, self.body)
+
+    def test_if_range_match(self):
+        etag = self.get().headers['ETag']
+        response = self.get(Range='bytes=0-9', **{'If-Range': etag})
+        self.assertEqual(response.status_code, 206)
+
+    def test_x_sendfile(self):
+        SettingsManager.add('send_file_mode', webserver.X_SENDFILE)
+        response = self.get()
+        self.assertEqual(response.headers['X-Sendfile'], os.path.abspath(self.location))
+        self.assertEqual(response.data, '')
+
+
+class ArchiveRouteTest(_ServerTest):
+    """ Tests sending archived feed pages. """
+
+    def setUp(self):
+        super(ArchiveRouteTest, self).setUp()
+        self.page = u.archive_user_feed(self.location, 1)
+
+    def test_archive_page(self):
+        response = self.get('/john.cleese/archive/feed_1.xml')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, self.body)
+        self.assertEqual(response.headers['ETag'], '"{}"'.format(u.content_hash(self.page)))
+        self.assertEqual(response.headers['Cache-Control'], webserver.ARCHIVE_CACHE_CONTROL)
+
+    def test_archive_page_not_modified(self):
+        etag = self.get('/john.cleese/archive/feed_1.xml').headers['ETag']
+        response = self.get('/john.cleese/archive/feed_1.xml', **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_rewritten_archive_page_is_resent(self):
+        etag = self.get('/john.cleese/archive/feed_1.xml').headers['ETag']
+        self.assertFalse('immutable' in webserver.ARCHIVE_CACHE_CONTROL)
+        with open(self.page, 'wb') as f:
+            f.write(self.body.replace('</channel>', '<!-- deleted --></channel>'))
+        response = self.get('/john.cleese/archive/feed_1.xml', **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_missing_archive_page(self):
+        self.assertEqual(self.get('/john.cleese/archive/feed_2.xml').status_code, 404)
+        self.assertEqual(self.get('/nobody/archive/feed_1.xml').status_code, 404)
+
+    def test_page_names_are_checked(self):
+        for page_name in ('..', '../feed.xml', 'feed_1.xml/..', '..feed_1.xml',
+                'feed.xml', 'settings.json', 'feed_1.xml.gz'):
+            self.assertEqual(webserver.ARCHIVE_PAGE_PATTERN.match(page_name), None)
+        self.assertEqual(self.get('/john.cleese/archive/..').status_code, 404)
+        self.assertEqual(self.get('/john.cleese/archive/%2E%2E').status_code, 404)
+        self.assertEqual(self.get('/john.cleese/archive/feed.xml').status_code, 404)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(FeedRouteTest)
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(ArchiveRouteTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,45 @@
+""" Tests for the precompiled feed queries. """
+
+import unittest
+import sys
+
+from lxml import etree
+
+sys.path.insert(0, '../')
+from model.xpaths import FEED, CHILD, ITEMS, child_text
+
+
+class XPathsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = etree.fromstring(
+                '<rss><channel xmlns:microblog="http://openmicroblog.com/">'
+                '<microblog:username>eric.idle</microblog:username>'
+                '<link>http://example.com</link>'
+                '<item><guid>1</guid><microblog:reply>http://example.com/reply</microblog:reply></item>'
+                '</channel></rss>').getroottree()
+
+    def test_plain_and_prefixed_elements(self):
+        self.assertEqual(FEED['username'](self.tree)[0].text, 'eric.idle')
+        self.assertEqual(FEED['link'](self.tree)[0].text, 'http://example.com')
+        self.assertEqual(FEED['docs'](self.tree), [])
+
+    def test_item_elements(self):
+        item = ITEMS(self.tree)[0]
+        self.assertEqual(CHILD['guid'](item)[0].text, '1')
+        self.assertEqual(CHILD['reply'](item)[0].text, 'http://example.com/reply')
+
+    def test_child_text(self):
+        item = ITEMS(self.tree)[0]
+        self.assertEqual(child_text(item, 'guid'), '1')
+        self.assertEqual(child_text(item, 'reply'), 'http://example.com/reply')
+        self.assertEqual(child_text(item, 'pubdate'), None)
+
+    def test_unlisted_elements_are_compiled_once(self):
+        query = CHILD['spam']
+        self.assertTrue(CHILD['spam'] is query)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(XPathsTest)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,279 @@
+""" A SQLite backing store for the main user's cached timeline.
+
+Items are stored one per row, keyed by their pubdate (as a UTC epoch)
+and guid, so adding an item is an index insert instead of a rewrite of
+the whole cache file, and reading a page only touches the rows on
+that page. Pages are addressed by cursor (the guid of an item on the
+page before), which is resolved through the guid index, so reading
+deep into the timeline costs the same as reading the first page.
+
+Each item also records the link of the feed it was read from, so a page
+can be limited to the feeds one user follows.
+
+The store also keeps the (author link, guid) of the items it has been
+given, so items can be recognized after they fall out of the timeline,
+and the latest profile (channel info) of every feed the crawler has
+read, keyed by feed link. Once the timeline is full, items older than
+its oldest item are neither added nor remembered, since they would be
+trimmed right away.
+"""
+
+import json
+import time
+
+from sqlitestore import SQLiteStore
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS timeline (
+    id INTEGER PRIMARY KEY,
+    guid TEXT,
+    pubdate INTEGER NOT NULL,
+    item TEXT NOT NULL,
+    link TEXT
+);
+CREATE INDEX IF NOT EXISTS timeline_order ON timeline (pubdate DESC, id ASC);
+CREATE INDEX IF NOT EXISTS timeline_guid ON timeline (guid);
+CREATE TABLE IF NOT EXISTS seen (
+    link TEXT,
+    guid TEXT,
+    pubdate INTEGER,
+    PRIMARY KEY (link, guid)
+);
+CREATE TABLE IF NOT EXISTS profiles (
+    link TEXT PRIMARY KEY,
+    updated INTEGER NOT NULL,
+    profile TEXT NOT NULL
+);
+'''
+
+# Reverse chronological, and oldest insert first for equal pubdates.
+ORDER = 'ORDER BY pubdate DESC, id ASC'
+REVERSE_ORDER = 'ORDER BY pubdate ASC, id DESC'
+
+# The pages after and before an item's (pubdate, id). The leading range
+# on pubdate lets SQLite seek timeline_order to the cursor instead of
+# scanning from the newest item; the OR only breaks ties on pubdate.
+AFTER = ('SELECT item FROM timeline WHERE pubdate <= ? AND (pubdate < ? OR id {} ?) '
+        'AND {} ' + ORDER + ' LIMIT ?')
+BEFORE = ('SELECT item FROM timeline WHERE pubdate >= ? AND (pubdate > ? OR id < ?) '
+        'AND {} ' + REVERSE_ORDER + ' LIMIT ?')
+
+
+class SQLiteTimelineStore(SQLiteStore):
+    """ Stores timeline items in a SQLite database. """
+
+    SCHEMA = SCHEMA
+
+    def __init__(self, location, max_items=1000):
+        self.max_items = max_items
+        super(SQLiteTimelineStore, self).__init__(location)
+        conn = self._connection()
+        with conn:
+            self._add_link_column(conn)
+            self._add_seen_pubdate_column(conn)
+            conn.execute('CREATE INDEX IF NOT EXISTS seen_pubdate ON seen (pubdate)')
+            # Older timelines indexed the link, which led SQLite to sort
+            # every followed feed's items before applying the LIMIT.
+            conn.execute('DROP INDEX IF EXISTS timeline_link')
+
+    def _add_link_column(self, conn):
+        """ Adds the link column to timelines created before it existed,
+        filled in from each item's author link. """
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(timeline)')]
+        if 'link' in columns:
+            return
+        conn.execute('ALTER TABLE timeline ADD COLUMN link TEXT')
+        rows = conn.execute('SELECT id, item FROM timeline').fetchall()
+        conn.executemany('UPDATE timeline SET link = ? WHERE id = ?',
+                (((json.loads(item).get('user') or {}).get('link'), item_id)
+                    for item_id, item in rows))
+
+    def _add_seen_pubdate_column(self, conn):
+        """ Adds the pubdate column to seen tables created before it
+        existed. The pubdates of the items already seen aren't known, so
+        they are kept until the timeline moves past the time of the
+        upgrade. """
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(seen)')]
+        if 'pubdate' in columns:
+            return
+        conn.execute('ALTER TABLE seen ADD COLUMN pubdate INTEGER')
+        conn.execute('UPDATE seen SET pubdate = ?', (int(time.time()),))
+
+    def _links_filter(self, conn, links):
+        """ Returns the condition that limits a query to the items from
+        the given feed links (always true if links is None). The links
+        are kept in a temp table, since a follows list can be longer
+        than the number of parameters a query may take.
+
+        The unary + keeps SQLite from using the link for the lookup, so
+        pages are still read in order from timeline_order and the LIMIT
+        stops the read once the page is full. """
+        if links is None:
+            return '1'
+        self._want_links(conn, links)
+        return '+link IN (SELECT link FROM wanted_links)'
+
+    def _want_links(self, conn, links):
+        """ Fills the wanted_links temp table with the given links. """
+        with conn:
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS wanted_links (link TEXT PRIMARY KEY)')
+            conn.execute('DELETE FROM wanted_links')
+            conn.executemany('INSERT OR IGNORE INTO wanted_links (link) VALUES (?)',
+                    ((link,) for link in links))
+
+    def _cutoff(self, conn):
+        """ Returns the pubdate of the oldest item the timeline keeps,
+        or None if the timeline isn't full. """
+        row = conn.execute('SELECT pubdate FROM timeline {} LIMIT 1 OFFSET ?'.format(ORDER),
+                (self.max_items - 1,)).fetchone()
+        if row is not None:
+            return row[0]
+
+    def _trim(self, conn):
+        """ Drops everything but the newest max_items items, and forgets
+        the seen items older than all of them. """
+        conn.execute('DELETE FROM timeline WHERE id IN '
+                '(SELECT id FROM timeline {} LIMIT -1 OFFSET ?)'.format(ORDER),
+                (self.max_items,))
+        cutoff = self._cutoff(conn)
+        if cutoff is not None:
+            conn.execute('DELETE FROM seen WHERE pubdate < ?', (cutoff,))
+
+    # Reading
+
+    def count(self):
+        return self._connection().execute('SELECT COUNT(*) FROM timeline').fetchone()[0]
+
+    def _items(self, rows):
+        return [json.loads(row[0]) for row in rows]
+
+    def _key(self, guid):
+        """ Returns the (pubdate, id) sort key of the item with the
+        given guid, or None if it is not cached. """
+        return self._connection().execute(
+                'SELECT pubdate, id FROM timeline WHERE guid = ? LIMIT 1',
+                (guid,)).fetchone()
+
+    def page(self, offset=0, n=25, links=None):
+        """ Returns n items, newest first, starting offset items in.
+        If links is given, only items from those feeds are returned. """
+        conn = self._connection()
+        rows = conn.execute(
+                'SELECT item FROM timeline WHERE {} {} LIMIT ? OFFSET ?'.format(
+                    self._links_filter(conn, links), ORDER),
+                (n, offset))
+        return self._items(rows)
+
+    def get(self, guid):
+        """ Returns the item with the given guid, or None. """
+        row = self._connection().execute(
+                'SELECT item FROM timeline WHERE guid = ? LIMIT 1', (guid,)).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+
+    def after(self, guid, n=25, inclusive=False, links=None):
+        """ Returns the n items that follow (are older than) the item
+        with the given guid, newest first. If inclusive, the page starts
+        with that item. If links is given, only items from those feeds
+        are returned. Returns an empty list if the guid is not cached. """
+        key = self._key(guid)
+        if key is None:
+            return []
+        pubdate, item_id = key
+        conn = self._connection()
+        rows = conn.execute(
+                AFTER.format('>=' if inclusive else '>', self._links_filter(conn, links)),
+                (pubdate, pubdate, item_id, n))
+        return self._items(rows)
+
+    def before(self, guid, n=25, links=None):
+        """ Returns the n items that precede (are newer than) the item
+        with the given guid, newest first. If links is given, only items
+        from those feeds are returned. Returns an empty list if the guid
+        is not cached. """
+        key = self._key(guid)
+        if key is None:
+            return []
+        pubdate, item_id = key
+        conn = self._connection()
+        rows = conn.execute(BEFORE.format(self._links_filter(conn, links)),
+                (pubdate, pubdate, item_id, n))
+        return list(reversed(self._items(rows)))
+
+    def is_seen(self, seen_key):
+        """ Checks if an item with the given (link, guid) has been added
+        (and not forgotten, see _trim). """
+        return self._connection().execute('SELECT 1 FROM seen WHERE link = ? AND guid = ?',
+                seen_key).fetchone() is not None
+
+    def profiles(self, links, max_age=None):
+        """ Returns the cached profiles of the given feed links, as a
+        dict keyed by link. Links with no cached profile, or with one
+        cached more than max_age seconds ago, are left out. """
+        conn = self._connection()
+        self._want_links(conn, links)
+        query = 'SELECT link, profile FROM profiles WHERE link IN (SELECT link FROM wanted_links)'
+        args = ()
+        if max_age is not None:
+            query += ' AND updated >= ?'
+            args = (int(time.time()) - max_age,)
+        return { link: json.loads(profile) for link, profile in conn.execute(query, args) }
+
+    # Writing
+
+    def set_profiles(self, profiles, max_age=None):
+        """ Caches the given profiles (a dict keyed by feed link) in one
+        transaction. Profiles cached more than max_age seconds ago are
+        dropped. """
+        conn = self._connection()
+        now = int(time.time())
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO profiles (link, updated, profile) '
+                    'VALUES (?, ?, ?)',
+                    ((link, now, json.dumps(profile)) for link, profile in profiles.iteritems()))
+            if max_age is not None:
+                conn.execute('DELETE FROM profiles WHERE updated < ?', (now - max_age,))
+
+    def add(self, item, pubdate, seen_key=None, link=None):
+        """ Adds the item to the timeline. pubdate is the item's
+        publication time as a UTC epoch, and link the feed it was read
+        from. seen_key, if given, is the item's (link, guid). Returns
+        True if the item was added. """
+        return self.add_many([(item, pubdate, link, seen_key)]) == 1
+
+    def add_many(self, items):
+        """ Adds every (item, pubdate, feed link, seen key) to the
+        timeline in one transaction, and returns the number added. Items
+        whose seen key, their (link, guid), has been added before are
+        skipped, as are items older than a full timeline keeps. The seen
+        key may be None. """
+        conn = self._connection()
+        added = 0
+        with conn:
+            cutoff = self._cutoff(conn)
+            for item, pubdate, link, seen_key in items:
+                if cutoff is not None and pubdate < cutoff:
+                    continue
+                if seen_key is not None:
+                    cursor = conn.execute('INSERT OR IGNORE INTO seen (link, guid, pubdate) '
+                            'VALUES (?, ?, ?)', tuple(seen_key) + (pubdate,))
+                    if cursor.rowcount == 0:
+                        continue
+                conn.execute('INSERT INTO timeline (guid, pubdate, item, link) '
+                        'VALUES (?, ?, ?, ?)', (item.get('guid'), pubdate, json.dumps(item), link))
+                added += 1
+            if added:
+                self._trim(conn)
+        return added
+
+    def remove(self, guid):
+        """ Removes every item with the given guid. """
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM timeline WHERE guid = ?', (guid,))
+
+    def clear(self):
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM timeline')
@@ -2,9 +2,18 @@
 """ Utilities for doing basic feed file IO.  """
 
 from lxml import etree
+from collections import OrderedDict
+from datetime import datetime
+import threading
+import tempfile
+import shutil
+import gzip
+import hashlib
 import os
 import json
 
+from feedindex import SQLiteFeedIndex
+
 
 # Util Functions
 
@@ -30,21 +39,282 @@ def convert_url(url, to_relative=False, to_absolute=False):
         raise ValueError
 
 
+def file_signature(location):
+    """ Returns a tuple that changes whenever the file is rewritten
+    (mtime, size, inode), or None if it does not exist. """
+    try:
+        return _stat_signature(os.stat(location))
+    except OSError:
+        return None
+
+
+def _stat_signature(st):
+    return st.st_mtime, st.st_size, st.st_ino
+
+
 # User Feed Stuff
 
 
-def get_user_feed(rel_location):
-    """ Get the etree representation of the feed located at the rel_location.  """
-    tree = None
-    with open(rel_location, 'r') as f:
+# Parsed feeds, most recently used last, keyed by path. Each entry holds
+# the (mtime, size, inode) of the file it was parsed from.
+FEED_CACHE_SIZE = 32
+_feed_cache = OrderedDict()
+_feed_cache_lock = threading.Lock()
+feed_cache_hits = 0
+feed_cache_misses = 0
+
+
+def get_user_feed(rel_location, read_only=False):
+    """ Get the etree representation of the feed located at the rel_location.
+
+    If read_only is True, the tree may be shared with other readers (from
+    the parsed feed cache) and must not be modified. """
+    global feed_cache_hits, feed_cache_misses
+    if not read_only:
+        with open(rel_location, 'r') as f:
+            return etree.parse(f)
+
+    path = os.path.abspath(rel_location)
+    signature = file_signature(path)
+    with _feed_cache_lock:
+        entry = _feed_cache.pop(path, None)
+        if entry is not None and entry[0] == signature:
+            feed_cache_hits += 1
+            _feed_cache[path] = entry
+            return entry[1]
+
+    feed_cache_misses += 1
+    with open(path, 'r') as f:
         tree = etree.parse(f)
+    with _feed_cache_lock:
+        _feed_cache[path] = (signature, tree)
+        while len(_feed_cache) > FEED_CACHE_SIZE:
+            _feed_cache.popitem(last=False)
     return tree
 
 
+def get_user_feed_header(rel_location):
+    """ Returns the text of every channel-level element in the feed
+    as a dict keyed by tag name (without namespace). Parsing stops at the
+    first item, so the cost does not depend on the number of items. """
+    header = {}
+    channel = None
+    with open(rel_location, 'r') as f:
+        for event, element in etree.iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                if channel is None and etree.QName(element).localname == 'channel':
+                    channel = element
+                elif element.getparent() is channel \
+                        and etree.QName(element).localname == 'item':
+                    break
+            elif element.getparent() is channel and channel is not None:
+                header.setdefault(etree.QName(element).localname, element.text)
+    return header
+
+
+def invalidate_user_feed(rel_location):
+    """ Drops the given feed from the parsed feed cache. """
+    with _feed_cache_lock:
+        _feed_cache.pop(os.path.abspath(rel_location), None)
+
+
 def write_user_feed(tree, rel_location):
     """ Write the etree representation of the feed to the rel_locaiton.  """
+    invalidate_user_feed(rel_location)
     with open(rel_location, 'w') as f:
         tree.write(f, pretty_print=True)
+    write_gzip_copy(rel_location)
+    meta = get_feed_meta(rel_location, recount=False)
+    meta['items'] = len(tree.xpath('//item'))
+    meta['size'] = get_user_feed_size(rel_location)
+    write_feed_meta(rel_location, meta)
+
+
+def append_user_feed_item(rel_location, element):
+    """ Adds the element to the end of the feed's channel without
+    parsing or rewriting the rest of the feed. The element is spliced in
+    before the closing </channel> tag, and the new file replaces the old
+    one atomically. Returns the feed's updated meta. """
+    meta = get_feed_meta(rel_location)
+    item = etree.tostring(element, pretty_print=True)
+
+    # Find the closing channel tag near the end of the file.
+    size = get_user_feed_size(rel_location)
+    with open(rel_location, 'rb') as f:
+        f.seek(max(size - 4096, 0))
+        tail_start = f.tell()
+        tail = f.read()
+    close_at = tail.rfind('</channel>')
+    if close_at < 0:
+        raise ValueError('No closing channel tag found in {}.'.format(rel_location))
+    splice_at = tail_start + close_at
+
+    directory = os.path.dirname(os.path.abspath(rel_location))
+    fd, temp_location = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as temp, open(rel_location, 'rb') as f:
+            copy_bytes(f, temp, splice_at)
+            temp.write(item)
+            shutil.copyfileobj(f, temp)
+        shutil.copymode(rel_location, temp_location)
+        invalidate_user_feed(rel_location)
+        os.rename(temp_location, rel_location)
+    except:
+        os.remove(temp_location)
+        raise
+
+    meta['items'] += 1
+    meta['size'] = size + len(item)
+    write_feed_meta(rel_location, meta)
+    return meta
+
+
+def copy_bytes(src, dest, n, chunk_size=65536):
+    """ Copies n bytes from the src file to the dest file. """
+    while n > 0:
+        chunk = src.read(min(n, chunk_size))
+        if not chunk:
+            break
+        dest.write(chunk)
+        n -= len(chunk)
+
+
+# Compressed Copies
+#
+# Every time a feed is rewritten a gzipped copy of it is written next to
+# it (feed.xml.gz), so the web server can send compressed feeds without
+# compressing them for each request. Appending a post leaves the copy
+# stale instead, so posting doesn't compress the whole feed; the copy is
+# rewritten the next time it is asked for.
+
+GZIP_SUFFIX = '.gz'
+
+
+def write_gzip_copy(rel_location):
+    """ Writes the gzipped copy of the given file and returns its
+    location. The copy replaces the old one atomically, so it is never
+    read half written. If the file is replaced while it is being
+    compressed, the copy is dropped and None is returned. """
+    directory = os.path.dirname(os.path.abspath(rel_location))
+    fd, temp_location = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as temp, open(rel_location, 'rb') as f:
+            signature = _stat_signature(os.fstat(f.fileno()))
+            # A fixed mtime keeps the copy identical for identical feeds.
+            with gzip.GzipFile(filename='', mode='wb', fileobj=temp, mtime=0) as z:
+                shutil.copyfileobj(f, z)
+        if file_signature(rel_location) != signature:
+            os.remove(temp_location)
+            return None
+        shutil.copymode(rel_location, temp_location)
+        os.rename(temp_location, rel_location + GZIP_SUFFIX)
+    except:
+        os.remove(temp_location)
+        raise
+    return rel_location + GZIP_SUFFIX
+
+
+def get_gzip_copy(rel_location):
+    """ Returns the location of the gzipped copy of the given file,
+    writing it first if there is no copy or the file has changed since
+    it was made. Returns None if the file does not exist. """
+    gz_location = rel_location + GZIP_SUFFIX
+    try:
+        mtime = os.path.getmtime(rel_location)
+    except OSError:
+        return None
+    try:
+        if os.path.getmtime(gz_location) >= mtime:
+            return gz_location
+    except OSError:
+        pass
+    return write_gzip_copy(rel_location)
+
+
+def file_validators(rel_location):
+    """ Returns a strong ETag and the last modified time (a UTC datetime)
+    for the given file, taken from its metadata (inode, mtime and size),
+    so the file does not have to be read. """
+    st = os.stat(rel_location)
+    etag = '{0:x}-{1:x}-{2:x}'.format(st.st_ino, int(st.st_mtime * 1000000), st.st_size)
+    return etag, datetime.utcfromtimestamp(int(st.st_mtime))
+
+
+# Hashes of file contents, keyed by path. Each entry holds the
+# (mtime, size, inode) of the file it was hashed from.
+_content_hashes = {}
+_content_hashes_lock = threading.Lock()
+
+
+def content_hash(rel_location):
+    """ Returns the SHA-1 of the file's contents. Files are only read
+    the first time, or after they change. """
+    path = os.path.abspath(rel_location)
+    signature = file_signature(path)
+    with _content_hashes_lock:
+        entry = _content_hashes.get(path)
+    if entry is not None and entry[0] == signature:
+        return entry[1]
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), ''):
+            sha1.update(chunk)
+    with _content_hashes_lock:
+        _content_hashes[path] = (signature, sha1.hexdigest())
+    return sha1.hexdigest()
+
+
+# Feed Meta
+#
+# Each feed has a small JSON sidecar (feed.xml.meta.json) that keeps
+# running counts for it, so they don't have to be recomputed by parsing
+# the feed. The sidecar also records the feed's size, so changes made
+# behind its back are noticed and the counts are rebuilt.
+
+FEED_META_SUFFIX = '.meta.json'
+
+
+def get_feed_meta(rel_location, recount=True):
+    """ Returns the meta for the feed: a dict with the item count
+    ('items') and byte size ('size') of the feed. If the meta is missing
+    or out of date and recount is True, it is rebuilt from the feed. """
+    meta = {}
+    meta_location = rel_location + FEED_META_SUFFIX
+    if os.path.isfile(meta_location):
+        with open(meta_location, 'r') as f:
+            meta = json.loads(f.read())
+    size = get_user_feed_size(rel_location)
+    if recount and (meta.get('size') != size or meta.get('items') is None):
+        meta['items'] = len(get_user_feed(rel_location, read_only=True).xpath('//item'))
+        meta['size'] = size
+        write_feed_meta(rel_location, meta)
+    return meta
+
+
+def write_feed_meta(rel_location, meta):
+    """ Writes the meta for the given feed. """
+    with open(rel_location + FEED_META_SUFFIX, 'w') as f:
+        f.write(json.dumps(meta, sort_keys=True, indent=4))
+
+
+# Feed Index
+#
+# Each feed also has an item index (feed.xml.index.db) that records which
+# page of the feed each item is on. See feedindex.py.
+
+FEED_INDEX_SUFFIX = '.index.db'
+_feed_indexes = {}
+_feed_indexes_lock = threading.Lock()
+
+
+def get_feed_index(rel_location):
+    """ Returns the item index of the given feed. """
+    path = os.path.abspath(rel_location)
+    with _feed_indexes_lock:
+        index = _feed_indexes.get(path)
+        if index is None:
+            index = _feed_indexes[path] = SQLiteFeedIndex(path + FEED_INDEX_SUFFIX)
+    return index
 
 
 def get_user_feed_size(rel_location):
@@ -52,15 +322,21 @@ def get_user_feed_size(rel_location):
     return os.path.getsize(rel_location)
 
 
-def archive_user_feed(src):
-    """ Moves the current user feed to the archive directory.
-    Returns the relative file name of the old file. """
-    import shutil as s, re, datetime
+def archive_user_feed(src, page_number):
+    """ Copies the current user feed to the archive directory next to it
+    (i.e. user/<user_id>/archive/feed_3.xml for page 3 of
+    user/<user_id>/feed.xml), along with its gzipped copy. Returns the
+    relative file name of the archived page. """
+    import shutil as s, re
     m = re.search(string=src, pattern=r'(feed|blocks|follows)+\.(xml|XML)')
-    orig_filename = m.group(0)
+    orig_filename = m.group(1)
 
-    filename = 'user/archive/{0}_{1}.xml'.format(orig_filename, datetime.datetime.now().strftime('%Y%m%d_%H%M%S'))
+    archive_dir = os.path.join(os.path.dirname(src), 'archive')
+    if not os.path.isdir(archive_dir):
+        os.mkdir(archive_dir)
+    filename = os.path.join(archive_dir, '{0}_{1}.xml'.format(orig_filename, page_number))
     s.copy2(src, filename)
+    write_gzip_copy(filename)
     return filename
 
 
@@ -94,17 +370,26 @@ def to_cache(cache, key, value):
 
 def from_settings(settings, key):
     """ Fetches a value from the settings. """
+    settings_data = read_settings(settings)
+    if settings_data is not None and key in settings_data.keys():
+        return settings_data[key]
+
+
+def read_settings(settings):
+    """ Fetches the entire settings dict. Returns None if no
+    settings file exists. """
     if os.path.isfile(settings):
         with open(settings, 'r') as f:
-            settings_data = json.loads(f.read())
-            if key in settings_data.keys():
-                return settings_data[key]
+            return json.loads(f.read())
 
 
 def to_settings(settings, key, value):
-    """ Adds a value to the settings file. """
+    """ Adds a value to the settings file. Returns the file's signature
+    (see file_signature) from just before it was read and from just after
+    it was written, or None if no settings file exists. """
     if os.path.isfile(settings):
         with open(settings, 'r+') as f:
+                read_signature = _stat_signature(os.fstat(f.fileno()))
                 current_settings = json.loads(f.read())
                 current_settings[key] = value
                 f.seek(0)
@@ -112,5 +397,7 @@ def to_settings(settings, key, value):
                     sort_keys=True,
                     indent=4))
                 f.truncate()
+                f.flush()
+                return read_signature, _stat_signature(os.fstat(f.fileno()))
 
 
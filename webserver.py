@@ -12,8 +12,11 @@ from functools import wraps
 from flask import Flask, request, session, url_for, redirect,\
     render_template, abort, Response
 from werkzeug import check_password_hash, generate_password_hash
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import wrap_file
 from flask_limiter import Limiter
 
+import util as u
 from cachemanager import CacheManager
 from settingsmanager import SettingsManager as settings
 from model.user import User
@@ -53,9 +56,130 @@ def login_required(f):
 
 
 def user_for_username(username):
-    for _, user_dict in settings.get('registered_users').iteritems():
-        if user_dict['username'] == username:
-            return user_dict
+    return settings.get_user_by_username(username)
+
+
+# File Serving
+#
+# Feeds are polled by every follower's crawler, so they are sent without
+# passing their bytes through Python. By default the file is handed to
+# the server's wsgi.file_wrapper (which mod_wsgi turns into sendfile when
+# WSGIEnableSendfile is on). If the 'send_file_mode' setting is
+# 'x-sendfile', only an X-Sendfile header is sent and Apache's
+# mod_xsendfile sends the file, and its ranges, itself.
+
+X_SENDFILE = 'x-sendfile'
+
+
+class _FileRange(object):
+    """ A file-like object that reads n bytes of the file from its
+    current position. """
+
+    def __init__(self, f, n):
+        self.f = f
+        self.n = n
+
+    def read(self, size=-1):
+        if size < 0 or size > self.n:
+            size = self.n
+        data = self.f.read(size)
+        self.n -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+def _requested_range(length, etag, last_modified):
+    """ Returns the (start, stop) byte range the request asks for, None
+    if the whole file should be sent, or False if the range can't be
+    satisfied. A Range whose If-Range doesn't match is ignored. """
+    byte_range = request.range
+    if byte_range is None:
+        return None
+    if_range = request.if_range
+    if (if_range.etag and if_range.etag != etag) \
+            or (if_range.date and if_range.date != last_modified):
+        return None
+    requested = byte_range.range_for_length(length)
+    if requested is None and len(byte_range.ranges) == 1:
+        return False
+    return requested
+
+
+def send_file(location, etag, last_modified, mimetype='text/xml', content_encoding=None):
+    """ Returns the file at location as a response, with the given
+    validators. Conditional requests that match them are answered with
+    304 Not Modified, and single byte ranges are supported. """
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    elif settings.get('send_file_mode') == X_SENDFILE:
+        response = Response(mimetype=mimetype)
+        response.headers['X-Sendfile'] = os.path.abspath(location)
+        response.content_length = os.path.getsize(location)
+    else:
+        f = open(location, 'rb')
+        length = os.fstat(f.fileno()).st_size
+        requested = _requested_range(length, etag, last_modified)
+        if requested is False:
+            f.close()
+            response = Response(status=416)
+            response.headers['Content-Range'] = 'bytes */{0}'.format(length)
+        elif requested is None:
+            response = Response(wrap_file(request.environ, f), mimetype=mimetype,
+                    direct_passthrough=True)
+            response.content_length = length
+        else:
+            start, stop = requested
+            f.seek(start)
+            response = Response(wrap_file(request.environ, _FileRange(f, stop - start)),
+                    status=206, mimetype=mimetype, direct_passthrough=True)
+            response.content_length = stop - start
+            response.content_range.set(start, stop, length)
+    if content_encoding is not None and response.status_code != 416:
+        response.content_encoding = content_encoding
+    response.accept_ranges = 'bytes'
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return response
+
+
+def send_feed(location, etag=None):
+    """ Returns the feed file at location as a response.
+
+    The response carries a strong ETag and Last-Modified, both taken from
+    the file's metadata by default, so the file is never read to build
+    them. Clients that accept gzip are sent the gzipped copy kept
+    alongside the feed, which is rewritten first if it is stale.
+    """
+    file_etag, last_modified = u.file_validators(location)
+    etag = etag or file_etag
+    gz_location = None
+    if request.accept_encodings.quality('gzip') > 0:
+        gz_location = u.get_gzip_copy(location)
+    if gz_location is not None:
+        # Each encoding is a different representation, with its own tag.
+        etag += '-gzip'
+    response = send_file(gz_location or location, etag, last_modified,
+            content_encoding='gzip' if gz_location else None)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+# Archived pages are rewritten in place when one of their posts is
+# deleted, so caches may keep them but must revalidate before reuse.
+# The content hash ETag makes that a cheap 304 until the page changes.
+ARCHIVE_CACHE_CONTROL = 'public, no-cache'
+ARCHIVE_PAGE_PATTERN = re.compile(r'^(feed|follows|blocks)_\d+\.xml$')
+
+
+def send_archive_page(location):
+    """ Returns the archived feed page at location as a response. Like
+    send_feed, but the ETag is a hash of the page's contents, so
+    caches revalidating the page get a 304 until it is rewritten. """
+    response = send_feed(location, etag=u.content_hash(location))
+    response.headers['Cache-Control'] = ARCHIVE_CACHE_CONTROL
+    return response
 
 
 ####################################################################
@@ -86,9 +210,10 @@ def home():
     # Single-user mode, user exists.
     else:
         user_id = settings.get('single_user_id')
-    link = settings.get('registered_users').get(user_id).get('feed_location')
-    user = User(local_url=link)
-    posts = user.home_timeline()
+    link = settings.get_user(user_id).get('feed_location')
+    user = User(local_url=link).load_profile()
+    # Older pages are asked for with the guid of the last post shown.
+    posts = user.home_timeline(start=request.args.get('after'))
     auth = True if 'user_id' in session else False
     return render_template('timeline.html', posts=posts, user=user,
             page_type='timeline', auth=auth)
@@ -122,14 +247,10 @@ def post_register():
     if 'user_id' in session:
         return redirect(url_for('home'))
     # No more users can register.
-    elif settings.get('single_user_mode') \
-            and len(settings.get('registered_users')) > 0:
+    elif settings.get('single_user_mode') and settings.user_count() > 0:
         error = 'No more users can register at this time.'
     # Username is alredy registered.
-    users = settings.get('registered_users')
-    username_taken = True if \
-            len([uid for uid, ud, in users.iteritems() if ud.get('username') == username]) > 0 \
-            else False
+    username_taken = settings.get_user_id_for_username(username) is not None
     if username_taken:
         return redirect(url_for('get_login'))
 
@@ -158,12 +279,13 @@ def post_register():
             settings.add('single_user_id', new_user.user_id)
 
         domain = settings.get('domain')
-        new_user.profile = 'http://{0}/{1}'.format(domain, new_user.username)
-        new_user.link = 'http://{0}/{1}/feed.xml'.format(domain, new_user.username)
-        new_user.follows_url = 'http://{0}/{1}/follows.xml'.format(domain, new_user.username)
-        new_user.blocks_url = 'http://{0}/{1}/blocks.xml'.format(domain, new_user.username)
-        new_user.message_url = 'http://{0}/{1}/message.'.format(domain, new_user.username)
-        new_user.language = 'en'
+        new_user.update(
+                profile='http://{0}/{1}'.format(domain, username),
+                link='http://{0}/{1}/feed.xml'.format(domain, username),
+                follows_url='http://{0}/{1}/follows.xml'.format(domain, username),
+                blocks_url='http://{0}/{1}/blocks.xml'.format(domain, username),
+                message_url='http://{0}/{1}/message.'.format(domain, username),
+                language='en')
 
         # Update the settings.
         pwd_hash = generate_password_hash(password)
@@ -194,16 +316,14 @@ def do_login():
     error = ''
     username = request.form['username']
     password = request.form['password']
-    username_and_ids = { ud['username']: uid for uid, ud in settings.get('registered_users').iteritems() }
+    user_id = settings.get_user_id_for_username(username)
 
-    if username not in username_and_ids.keys():
+    if user_id is None:
         error = 'Invalid username'
-
-    pwd_hash =  settings.get_user(username_and_ids[username]).get('pwd_hash')
-    if not check_password_hash(pwd_hash, password):
+    elif not check_password_hash(settings.get_user(user_id).get('pwd_hash'), password):
         error = 'Invalid password'
     else:
-        session['user_id'] = username_and_ids[username]
+        session['user_id'] = user_id
         return redirect(url_for('home'))
     return render_template('login.html', error=error)
 
@@ -226,7 +346,7 @@ def get_account():
     """ Allows the user to make changes to their profile. """
     user_id = session['user_id']
     location = settings.get_user(user_id)['feed_location']
-    user = User(local_url=location)
+    user = User(local_url=location).load_profile()
     return render_template('account.html', user=user)
 
 
@@ -237,18 +357,23 @@ def post_account():
     # Full name
     user_id = session['user_id']
     location = settings.get_user(user_id)['feed_location']
-    user = User(local_url=location)
-
-    if request.form.get('full_name_changed') == 'true':
-        user.full_name = request.form['full_name']
-    # Username
-    if request.form.get('username_changed') == 'true':
-        username= request.form['username']
-        if len(username) > 0:
-            user.username = username
-    # Bio
-    if request.form.get('bio_changed') == 'true':
-        user.description = request.form['bio']
+    user = User(local_url=location).load_profile()
+
+    # Write all of the feed changes at once.
+    with user.batch():
+        if request.form.get('full_name_changed') == 'true':
+            user.full_name = request.form['full_name']
+        # Username
+        if request.form.get('username_changed') == 'true':
+            username= request.form['username']
+            if len(username) > 0:
+                user.username = username
+        # Bio
+        if request.form.get('bio_changed') == 'true':
+            user.description = request.form['bio']
+        # Language
+        if request.form.get('language_changed') == 'true':
+            user.language = request.form['language']
     # Email
     if request.form.get('email_changed') == 'true':
         email = request.form['email']
@@ -263,9 +388,6 @@ def post_account():
             user_dict = settings.get_user(user_id)
             user_dict['pwd_hash'] = generate_password_hash(password)
             settings.add_user(user_dict)
-    # Language
-    if request.form.get('language_changed') == 'true':
-        user.language = request.form['language']
     return render_template('account.html', user=user, error='Your settings have been saved.')
 
 
@@ -278,7 +400,7 @@ def get_user_profile(username):
     user = None
     user_dict = user_for_username(username)
     if user_dict is not None:
-        user = User(local_url=user_dict['feed_location'])
+        user = User(local_url=user_dict['feed_location']).load_profile()
     else:
         # User is remote.
         # TODO
@@ -294,7 +416,7 @@ def get_user_follows(username):
     user = None
     user_dict = user_for_username(username)
     if user_dict is not None:
-        user = User(local_url=user_dict['feed_location'])
+        user = User(local_url=user_dict['feed_location']).load_profile()
     else:
         # User is remote.
         # TODO
@@ -310,7 +432,7 @@ def get_user_blocks(username):
     user = None
     user_dict = user_for_username(username)
     if user_dict is not None:
-        user = User(local_url=user_dict['feed_location'])
+        user = User(local_url=user_dict['feed_location']).load_profile()
     else:
         # User is remote.
         # TODO
@@ -327,14 +449,12 @@ def get_user_status(username, status_id):
     user = None
     user_dict = user_for_username(username)
     if user_dict is not None:
-        user = User(local_url=user_dict['feed_location'])
+        user = User(local_url=user_dict['feed_location']).load_profile()
     else:
         # TODO
         pass
-    posts = user.user_timeline()
-    posts = [post for post in posts if post.guid == status_id]
-    if len(posts) > 0:
-        post = posts[0]
+    post = user.get_status(status_id)
+    if post is not None:
         return render_template('individual_post.html', user=user, status=post)
     else:
         # TODO 404
@@ -476,24 +596,35 @@ def post_unblock():
 def feed(username):
     """ This just returns the user's XML feed. """
     location = user_for_username(username)['feed_location']
-    with open(location) as f:
-        return Response(f.read(), mimetype='text/xml')
+    return send_feed(location)
 
 
 @app.route('/<username>/blocks.xml', methods=['GET'])
 def blocks(username):
     """ Returns the user's block list. """
     location = user_for_username(username)['blocks_location']
-    with open(location) as f:
-        return Response(f.read(), mimetype='text/xml')
+    return send_feed(location)
 
 
 @app.route('/<username>/follows.xml', methods=['GET'])
 def follows(username):
-    """ Returns the user's block list. """
+    """ Returns the user's follows list. """
     location = user_for_username(username)['follows_location']
-    with open(location) as f:
-        return Response(f.read(), mimetype='text/xml')
+    return send_feed(location)
+
+
+@app.route('/<username>/archive/<page_name>', methods=['GET'])
+def archive(username, page_name):
+    """ Returns one of the user's archived feed pages
+    (i.e. /username/archive/feed_3.xml). """
+    user_dict = user_for_username(username)
+    if user_dict is None or not ARCHIVE_PAGE_PATTERN.match(page_name):
+        abort(404)
+    location = os.path.join(os.path.dirname(user_dict['feed_location']),
+            'archive', page_name)
+    if not os.path.isfile(location):
+        abort(404)
+    return send_archive_page(location)
 
 
 if __name__ == '__main__':